@@ -0,0 +1,126 @@
+import heapq
+from collections import deque
+from functools import lru_cache
+
+
+class AhoCorasick:
+    # 由一组模式串构造的自动机，扫描一遍文本即可找出所有模式串的所有出现位置
+
+    def __init__(self, patterns=()):
+        self.patterns = [p for p in dict.fromkeys(patterns) if p]
+        self.longest = max(map(len, self.patterns), default=0)
+        self.goto = [{}]  # 每个状态的转移
+        self.fail = [0]
+        self.output = [()]  # 每个状态结束的模式串，包括沿失配链接可达的状态结束的
+
+        for pattern in self.patterns:
+            state = 0
+            for ch in pattern:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] += (pattern,)
+
+        # 按层次遍历计算失配链接
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                f = self.goto[f].get(ch, 0)
+                self.fail[next_state] = f
+                self.output[next_state] += self.output[f]
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def compile(patterns=()):
+        # patterns 为元组，按模式串集合缓存构造好的自动机
+        return AhoCorasick(patterns)
+
+    def find_all(self, text, begin=0, end=None, whole_word=False, overlapping=True):
+        # 依次返回 (位置, 模式串)，同一位置结束的多个匹配先给出较长的；
+        # whole_word 为 True 时只保留前后都不是单词字符的匹配，与正则中的 \b 相同。
+        # overlapping 为 False 时从左到右取互不重叠的匹配，同一位置开始的取最长的，按位置递增返回
+        if not overlapping:
+            yield from self.leftmost_longest(self.find_all(text, begin, end, whole_word))
+            return
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        if end is None:
+            end = len(text)
+        state = 0
+        for i in range(max(0, begin), end):
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern in output[state]:
+                pos = i - len(pattern) + 1
+                if pos < begin:
+                    continue
+                if whole_word and (self.is_word(text, pos - 1) or self.is_word(text, i + 1)):
+                    continue
+                yield pos, pattern
+
+    def leftmost_longest(self, matches):
+        # matches 按结束位置递增。结束于 i 之后的匹配最早从 i - longest + 2 开始，
+        # 起点在此之前的候选已经不会再有更靠左或同一位置更长的，可以确定取舍
+        pending = []  # (位置, -长度, 模式串)
+        last_end = 0  # 已返回的最后一个匹配的结束位置
+        for pos, pattern in matches:
+            heapq.heappush(pending, (pos, -len(pattern), pattern))
+            limit = pos + len(pattern) - self.longest + 1
+            while pending and pending[0][0] < limit:
+                start, _, word = heapq.heappop(pending)
+                if start >= last_end:
+                    last_end = start + len(word)
+                    yield start, word
+        while pending:
+            start, _, word = heapq.heappop(pending)
+            if start >= last_end:
+                last_end = start + len(word)
+                yield start, word
+
+    def search(self, text, begin=0):
+        # 最先开始的匹配 (位置, 模式串)，同一位置开始的取最长的，没有时返回 (-1, '')
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        best = (-1, '')
+        state = 0
+        for i in range(max(0, begin), len(text)):
+            # 之后结束的匹配不可能比已找到的开始得更早
+            if best[0] != -1 and i >= best[0] + self.longest:
+                break
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern in output[state]:
+                pos = i - len(pattern) + 1
+                if pos >= begin and (best[0] == -1 or pos < best[0] or pos == best[0] and len(pattern) > len(best[1])):
+                    best = (pos, pattern)
+        return best
+
+    @staticmethod
+    def is_word(text, i):
+        if 0 <= i < len(text):
+            ch = text[i]
+            return ch.isalnum() or ch == '_'
+        return False
+
+
+if __name__ == '__main__':
+    ac = AhoCorasick(['he', 'she', 'his', 'hers'])
+    print(list(ac.find_all('ushers')))
+    print(list(AhoCorasick(['in', 'int', 'print']).find_all('print(int(x)) in y', whole_word=True)))
+    print(list(AhoCorasick(['in', 'int']).find_all('print(int(x))', overlapping=False)))
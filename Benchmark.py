@@ -0,0 +1,254 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from ParallelSearch import ParallelSearch
+from PieceTable import PieceTable
+
+# 文档大小 1KB ~ 100MB
+SIZES = [1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 100 << 20]
+WORDS = ['piece', 'table', 'editor', 'alpha', 'coder', 'undo', 'redo', 'buffer', 'search', 'the', 'a', 'of']
+
+
+def make_text(size: int, rng):
+    # 由随机单词组成、每行约 60 个字符的文本
+    parts = []
+    length = 0
+    line = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        line += len(word) + 1
+        sep = '\n' if line > 60 else ' '
+        if sep == '\n':
+            line = 0
+        parts.append(word + sep)
+        length += len(word) + 1
+    return ''.join(parts)[:size]
+
+
+# 每个 trace 是一个生成器，依次给出要计时的操作；操作的返回值会 send 回生成器，
+# 生成器在两次 yield 之间做的准备工作不计时
+
+def trace_typing(pt, rng, ops):
+    # 在文档中间连续输入，每 60 个字符换一次行
+    pos = len(pt) // 2
+    sentence = 'the quick brown fox jumps over the lazy dog '
+    for i in range(ops):
+        ch = '\n' if i % 60 == 59 else sentence[i % len(sentence)]
+        yield lambda: pt.insert(pos, ch)
+        pos += 1
+
+
+def trace_random_edits(pt, rng, ops):
+    for i in range(ops):
+        if i % 2 == 0 or len(pt) < 32:
+            pos = rng.randrange(len(pt) + 1)
+            word = rng.choice(WORDS) + ' '
+            yield lambda: pt.insert(pos, word)
+        else:
+            begin = rng.randrange(len(pt) - 20)
+            end = begin + rng.randrange(20)
+            yield lambda: pt.delete(begin, end)
+
+
+def trace_paste_storm(pt, rng, ops):
+    # 在随机位置反复粘贴 4KB 的文本
+    clip = make_text(4 << 10, rng)
+    for i in range(ops):
+        pos = rng.randrange(len(pt) + 1)
+        yield lambda: pt.insert(pos, clip)
+
+
+def trace_undo_redo(pt, rng, ops):
+    # 先做 ops 次不计时的修改，再全部撤销、全部重做
+    for i in range(ops):
+        pos = rng.randrange(len(pt) + 1)
+        if i % 3 == 2 and len(pt) > 8:
+            pt.delete(pos - 8, pos - 1)
+        else:
+            pt.insert(pos, rng.choice(WORDS))
+    for i in range(ops):
+        yield pt.undo
+    for i in range(ops):
+        yield pt.redo
+
+
+def trace_get_sequence(pt, rng, ops):
+    # 每次修改后都取一次全文
+    for i in range(ops):
+        pt.insert(rng.randrange(len(pt) + 1), rng.choice(WORDS))
+        yield pt.get_sequence
+
+
+def trace_find(pt, rng, ops):
+    # 从头开始反复查找下一个，到结尾后回到开头
+    pattern = 'editor'
+    pos = 0
+    for i in range(ops):
+        index = yield lambda: pt.find(pattern, pos)
+        pos = 0 if index == -1 else index + len(pattern)
+
+
+def trace_replace_all(pt, rng, ops):
+    # 查找全部匹配后一次替换，两个单词来回替换
+    pattern, text = 'buffer', 'BUFFER'
+
+    def replace_all():
+        indexes = []
+        index = pt.find(pattern, 0)
+        while index != -1:
+            indexes.append(index)
+            index = pt.find(pattern, index + len(pattern))
+        pt.apply_edits([(index, len(pattern), text) for index in indexes])
+
+    for i in range(ops):
+        yield replace_all
+        pattern, text = text, pattern
+
+
+def trace_find_all_serial(pt, rng, ops):
+    # 与 find_all_parallel 对比：修改一处后在 piece 上串行找出全部匹配
+    search = ParallelSearch(1)
+    for i in range(ops):
+        pt.insert(rng.randrange(len(pt) + 1), 'x')
+        yield lambda: pt.find_all_parallel('editor', search=search)
+
+
+def trace_find_all_parallel(pt, rng, ops):
+    search = ParallelSearch()
+    try:
+        for i in range(ops):
+            pt.insert(rng.randrange(len(pt) + 1), 'x')
+            yield lambda: pt.find_all_parallel('editor', search=search)
+    finally:
+        search.close()
+
+
+# (名称, trace, 默认操作数与 --ops 的比例)：整体扫描全文的 trace 只跑很少几次
+TRACES = [
+    ('typing', trace_typing, 1),
+    ('random_edits', trace_random_edits, 1),
+    ('paste_storm', trace_paste_storm, 0.1),
+    ('undo_redo', trace_undo_redo, 0.5),
+    ('get_sequence', trace_get_sequence, 0.05),
+    ('find', trace_find, 0.5),
+    ('replace_all', trace_replace_all, 0.002),
+    ('find_all_serial', trace_find_all_serial, 0.002),
+    ('find_all_parallel', trace_find_all_parallel, 0.002),
+]
+
+
+def run_trace(trace, text: str, ops: int, seed: int, memory: bool):
+    rng = random.Random(seed)
+    pt = PieceTable(text)
+    if memory:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+    latencies = []
+    gen = trace(pt, rng, ops)
+    try:
+        op = next(gen)
+        while True:
+            start = time.perf_counter()
+            result = op()
+            latencies.append(time.perf_counter() - start)
+            op = gen.send(result)
+    except StopIteration:
+        pass
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    pt.close()
+    return latencies, peak
+
+
+def percentile(values, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(sizes, ops: int, seed: int, traces=None, memory=True, log=sys.stderr):
+    results = []
+    for size in sizes:
+        text = make_text(size, random.Random(seed))
+        for name, trace, scale in TRACES:
+            if traces and name not in traces:
+                continue
+            count = max(1, int(ops * scale))
+            # 计时和内存分开跑同一个 trace，tracemalloc 会明显拖慢计时
+            latencies, _ = run_trace(trace, text, count, seed, False)
+            peak = run_trace(trace, text, count, seed, True)[1] if memory else None
+            total = sum(latencies)
+            result = {
+                'trace': name,
+                'size': size,
+                'ops': len(latencies),
+                'ops_per_sec': len(latencies) / total if total else None,
+                'p50_us': percentile(latencies, 0.5) * 1e6,
+                'p99_us': percentile(latencies, 0.99) * 1e6,
+                'peak_bytes': peak,
+            }
+            results.append(result)
+            print('%-18s %10d B %8d ops %12.1f ops/s  p50 %10.1f us  p99 %10.1f us  peak %s' % (
+                name, size, result['ops'], result['ops_per_sec'] or 0, result['p50_us'], result['p99_us'], peak),
+                file=log)
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ops': ops,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare(old, new, threshold: float):
+    # 返回 p50 或 p99 变慢超过 threshold 倍的项
+    old_results = {(r['trace'], r['size']): r for r in old['results']}
+    regressions = []
+    for r in new['results']:
+        o = old_results.get((r['trace'], r['size']))
+        if o is None:
+            continue
+        for key in ('p50_us', 'p99_us'):
+            if o[key] and r[key] / o[key] > threshold:
+                regressions.append((r['trace'], r['size'], key, o[key], r[key]))
+    return regressions
+
+
+def size_of(s: str):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    s = s.strip().upper().rstrip('B')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PieceTable benchmark')
+    parser.add_argument('--sizes', default='1K,10K,100K,1M,10M,100M', help='document sizes, e.g. 1K,1M')
+    parser.add_argument('--ops', type=int, default=2000, help='operations per trace')
+    parser.add_argument('--traces', default='', help='comma separated trace names, default all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='previous result file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    report = run([size_of(s) for s in args.sizes.split(',')], args.ops, args.seed,
+                 [t for t in args.traces.split(',') if t], not args.no_memory)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for name, size, key, old, new in regressions:
+            print('regression: %s %d B %s %.1f -> %.1f us' % (name, size, key, old, new))
+        if regressions:
+            sys.exit(1)
@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+
 class BoyerMoore:
 
     def __init__(self, text='', pattern=''):
@@ -5,26 +8,83 @@ class BoyerMoore:
         self.pattern = pattern
         self.n = len(self.text)
         self.m = len(self.pattern)
+        # 好后缀表和坏字符表只与模式串有关，生成一次后可用于任意文本和起点
+        self.good_suffix = None
+        self.bad_character = None
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def compile(pattern=''):
+        # 按模式串缓存已生成好表的查找对象，反复查找同一个模式串时不再重建
+        bm = BoyerMoore('', pattern)
+        bm.prepare()
+        return bm
+
+    def prepare(self):
+        if self.good_suffix is None:
+            self.good_suffix = self.get_good_suffix()
+            self.bad_character = self.get_bad_character()
 
     def boyer_moore(self, begin=0):
-        good_suffix = self.get_good_suffix()
-        bad_character = self.get_bad_character()
+        return self.search(self.text, begin)
+
+    def search(self, text, begin=0):
+        # 在 text 中从 begin 开始查找模式串，返回第一次出现的位置，没有时返回 -1
+        for j in self.find_all(text, begin, True):
+            return j
+        return -1
+
+    def find_all(self, text, begin=0, overlapping=False):
+        # 从左到右扫描一遍，依次给出每个匹配的位置；overlapping 为 False 时匹配之间不重叠
+        self.prepare()
+        good_suffix = self.good_suffix
+        bad_character = self.bad_character
+        pattern = self.pattern
+        m = self.m
 
-        j = begin
-        while j <= (self.n - self.m):
-            i = self.m - 1
-            while i >= 0 and self.pattern[i] == self.text[i + j]:
+        j = max(0, begin)
+        while j <= (len(text) - m):
+            i = m - 1
+            while i >= 0 and pattern[i] == text[i + j]:
                 i -= 1
             if i < 0:
-                return j
+                yield j
+                if not m:
+                    return
+                # 完整匹配后按模式串的最短周期移动
+                j += good_suffix[0] if overlapping else m
             else:
-                j += max(bad_character[ord(self.text[i + j])] - self.m + 1 + i, good_suffix[i])
-        return -1
+                j += max(bad_character.get(text[i + j], m) - m + 1 + i, good_suffix[i])
+
+    def find_all_chunks(self, chunks, begin=0, overlapping=False):
+        # chunks 为从 begin 开始依次相连的文本块，不拼接全文。
+        # 上一块末尾的 m - 1 个字符留到下一块前面一起查找，跨块的匹配也能找到
+        if not self.m:
+            yield begin
+            return
+        keep = self.m - 1
+        carry = ''
+        base = begin  # carry + chunk 在全文中的起点
+        start = begin  # 下一个匹配最早可以开始的位置
+        for chunk in chunks:
+            window = carry + chunk
+            for j in self.find_all(window, start - base, overlapping):
+                yield base + j
+                start = base + j + (1 if overlapping else self.m)
+            carry = window[max(0, len(window) - keep):]
+            base += len(window) - len(carry)
+
+    def count(self, text, begin=0, overlapping=False):
+        if self.m and not overlapping:
+            return text.count(self.pattern, max(0, begin))
+        return sum(1 for _ in self.find_all(text, begin, overlapping))
 
     def get_suffix(self):
         f = 0
         g = self.m - 1
-        suff = [0] * 256
+        suff = [0] * self.m
+        if not self.m:
+            return suff
         suff[self.m - 1] = self.m
 
         for i in range(self.m - 2, -1, -1):
@@ -58,10 +118,11 @@ class BoyerMoore:
         return gs
 
     def get_bad_character(self):
-        bc = [self.m] * 256
+        # 只记录模式串中出现过的字符，其余字符的移动距离为 m，任意 Unicode 字符都可以查找
+        bc = {}
 
         for i in range(self.m - 1):
-            bc[ord(self.pattern[i])] = self.m - 1 - i
+            bc[self.pattern[i]] = self.m - 1 - i
 
         return bc
 
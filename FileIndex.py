@@ -0,0 +1,329 @@
+import bisect
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from BoyerMoore import BoyerMoore
+
+
+class FileIndex:
+    # 目录树的三元组倒排索引：记录每个文件（UTF-8 编码后）出现过的所有三字节组。
+    # 查找时只读取包含查找串全部三字节组的文件，再用 BoyerMoore 确认；
+    # 索引保存在当前用户的缓存目录中（不写进项目目录），再次打开时只重新索引大小或修改时间变了的文件。
+    # 索引文件：magic、JSON 文件头的长度 (<I)、JSON 文件头，之后依次为小端序的 array('I')：
+    # 各三元组、各三元组倒排表的长度、所有倒排表首尾相接。读取时不执行文件中的任何代码
+    version = 2
+    magic = b'ACIX'
+    header_size = struct.Struct('<I')
+    temp_prefix = '.acindex-'
+    max_size = 8 << 20  # 更大的文件不索引也不查找
+    skip_dirs = {'__pycache__', 'node_modules', 'venv'}  # 另外所有以 . 开头的目录也跳过
+    encodings = ('utf-8', 'gbk')
+
+    def __init__(self, root, path=None):
+        self.root = os.path.abspath(root)
+        self.path = path or self.default_path(self.root)
+        self.files = []  # 文件编号 -> (相对路径, 大小, 修改时间)，删除或重新索引后为 None
+        self.ids = {}  # 相对路径 -> 文件编号
+        self.postings = {}  # 三元组 -> 包含它的文件编号 array('I')，递增
+        self.skipped = {}  # 二进制、太大或无法解码的文件 相对路径 -> (大小, 修改时间)
+        self.dead = 0  # files 中 None 的个数
+        self.modified = False
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def cache_dir():
+        if os.name == 'nt':
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+        else:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+        return os.path.join(base, 'alphaCoder', 'index')
+
+    @classmethod
+    def default_path(cls, root):
+        # 按根目录的绝对路径区分各个文件夹的索引
+        digest = hashlib.sha1(root.encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(cls.cache_dir(), digest + '.idx')
+
+    @staticmethod
+    def read_array(f, count):
+        ids = array('I')
+        data = f.read(count * ids.itemsize)
+        if len(data) != count * ids.itemsize:
+            raise ValueError('truncated index')
+        ids.frombytes(data)
+        if sys.byteorder == 'big':
+            ids.byteswap()
+        return ids
+
+    @staticmethod
+    def write_array(f, ids):
+        if sys.byteorder == 'big':
+            ids = array('I', ids)
+            ids.byteswap()
+        f.write(ids.tobytes())
+
+    def load(self):
+        # 索引不存在、版本或根目录不符、内容损坏时从空索引开始，之后的 scan 会重新建立
+        try:
+            with open(self.path, 'rb') as f:
+                if f.read(len(self.magic)) != self.magic:
+                    return
+                size, = self.header_size.unpack(f.read(self.header_size.size))
+                header = json.loads(f.read(size).decode('utf-8'))
+                if header.get('version') != self.version or header.get('root') != self.root:
+                    return
+                files = [tuple(entry) if entry else None for entry in header['files']]
+                skipped = {rel: tuple(key) for rel, key in header['skipped'].items()}
+                trigrams = self.read_array(f, header['trigrams'])
+                counts = self.read_array(f, len(trigrams))
+                ids = self.read_array(f, sum(counts))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, struct.error):
+            return
+        postings = {}
+        offset = 0
+        for trigram, count in zip(trigrams, counts):
+            postings[trigram] = ids[offset: offset + count]
+            offset += count
+        self.files = files
+        self.postings = postings
+        self.skipped = skipped
+        self.ids = {entry[0]: i for i, entry in enumerate(self.files) if entry}
+        self.dead = len(self.files) - len(self.ids)
+
+    def save(self, compact=False):
+        # 与 PieceTable.save 一样先写临时文件再替换，中途出错不会损坏已有的索引。
+        # compact 为 True 时先去掉已删除的文件编号；编号变了以后尚未结束的 search 会取到别的文件，
+        # 所以只在确定没有查找进行时（关闭文件夹、refresh）才压缩
+        if compact and self.dead > len(self.ids):
+            self.compact()
+        if not self.modified:
+            return
+        trigrams = array('I', self.postings)
+        counts = array('I', [len(self.postings[trigram]) for trigram in trigrams])
+        header = json.dumps({'version': self.version, 'root': self.root, 'files': self.files,
+                             'skipped': self.skipped, 'trigrams': len(trigrams)}).encode('utf-8')
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=self.temp_prefix, dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.magic + self.header_size.pack(len(header)) + header)
+                self.write_array(f, trigrams)
+                self.write_array(f, counts)
+                for trigram in trigrams:
+                    self.write_array(f, self.postings[trigram])
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.modified = False
+
+    def compact(self):
+        # 去掉已删除的文件编号，重新连续编号
+        remap = {}
+        files = []
+        for i, entry in enumerate(self.files):
+            if entry:
+                remap[i] = len(files)
+                files.append(entry)
+        postings = {}
+        for trigram, ids in self.postings.items():
+            ids = array('I', [remap[i] for i in ids if i in remap])
+            if ids:
+                postings[trigram] = ids
+        self.files = files
+        self.postings = postings
+        self.ids = {entry[0]: i for i, entry in enumerate(files)}
+        self.dead = 0
+        self.modified = True
+
+    def scan(self):
+        # 遍历目录树，重新索引新增和修改过的文件，删除已不存在的文件；
+        # 每检查一个文件 yield 一次，调用方可以分多次执行
+        seen = set()
+        index_dir = os.path.dirname(self.path)
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in self.skip_dirs]
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                if full == self.path or dirpath == index_dir and name.startswith(self.temp_prefix):
+                    # 缓存目录在根目录之内时（例如打开了整个用户目录）不索引索引文件自己
+                    continue
+                rel = os.path.relpath(full, self.root)
+                try:
+                    stat = os.stat(full)
+                except OSError:
+                    continue
+                seen.add(rel)
+                if not self.unchanged(rel, stat):
+                    self.index_file(rel, stat)
+                yield rel
+        for rel in set(self.ids).difference(seen):
+            self.remove_file(rel)
+        for rel in set(self.skipped).difference(seen):
+            del self.skipped[rel]
+            self.modified = True
+
+    def refresh(self):
+        for _ in self.scan():
+            pass
+        self.save(compact=True)
+
+    def unchanged(self, rel, stat):
+        key = (stat.st_size, stat.st_mtime_ns)
+        if rel in self.ids:
+            return self.files[self.ids[rel]][1:] == key
+        return self.skipped.get(rel) == key
+
+    def update_file(self, filename):
+        # 编辑器保存文件后调用，只重新索引这一个文件
+        rel = os.path.relpath(os.path.abspath(filename), self.root)
+        if rel.startswith(os.pardir):
+            return
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            self.remove_file(rel)
+            return
+        self.index_file(rel, stat)
+
+    def remove_file(self, rel):
+        i = self.ids.pop(rel, None)
+        if i is not None:
+            self.files[i] = None
+            self.dead += 1
+            self.modified = True
+        if self.skipped.pop(rel, None) is not None:
+            self.modified = True
+
+    def index_file(self, rel, stat):
+        # 旧的编号作废，新内容用新的编号追加到各个倒排表末尾，倒排表保持递增
+        self.remove_file(rel)
+        self.modified = True
+        key = (stat.st_size, stat.st_mtime_ns)
+        text = self.read_text(os.path.join(self.root, rel), stat.st_size)
+        if text is None:
+            self.skipped[rel] = key
+            return None
+        i = len(self.files)
+        self.files.append((rel,) + key)
+        self.ids[rel] = i
+        for trigram in self.trigrams(text.encode('utf-8')):
+            ids = self.postings.get(trigram)
+            if ids is None:
+                self.postings[trigram] = array('I', [i])
+            else:
+                ids.append(i)
+        return text
+
+    @classmethod
+    def read_text(cls, filename, size):
+        # 与打开文件时相同，先按 UTF-8 再按 GBK 解码；二进制、太大或无法解码时返回 None
+        if size > cls.max_size:
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read(cls.max_size + 1)
+        except OSError:
+            return None
+        if len(data) > cls.max_size or b'\0' in data[:8192]:
+            return None
+        for encoding in cls.encodings:
+            try:
+                return data.decode(encoding)
+            except UnicodeDecodeError:
+                pass
+        return None
+
+    @staticmethod
+    def trigrams(data: bytes):
+        return {a << 16 | b << 8 | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+    def candidates(self, pattern: str):
+        # 可能包含 pattern 的文件编号，递增
+        trigrams = self.trigrams(pattern.encode('utf-8'))
+        if not trigrams:
+            # 少于三个字节时无法过滤
+            return sorted(self.ids.values())
+        lists = []
+        for trigram in trigrams:
+            ids = self.postings.get(trigram)
+            if ids is None:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            if not result:
+                break
+            if len(result) * 16 < len(ids):
+                # 候选已经很少时在长倒排表中二分查找，不必整表遍历
+                result = {i for i in result if self.contains(ids, i)}
+            else:
+                result.intersection_update(ids)
+        return sorted(i for i in result if self.files[i])
+
+    @staticmethod
+    def contains(ids, i):
+        k = bisect.bisect_left(ids, i)
+        return k < len(ids) and ids[k] == i
+
+    def search(self, pattern: str):
+        # 依次返回每处匹配 (文件路径, 行号, 列号, 该行文本)，行号、列号从 0 开始；
+        # 与编辑器打开文件时一样把 \r\n 和 \r 当作 \n，行列号可以直接用来定位。
+        # 边读取候选文件边返回，不必等全部文件查找完
+        if not pattern:
+            return
+        bm = BoyerMoore.compile(pattern)
+        for i in self.candidates(pattern):
+            entry = self.files[i]
+            if entry is None:
+                continue
+            rel = entry[0]
+            full = os.path.join(self.root, rel)
+            try:
+                stat = os.stat(full)
+            except OSError:
+                self.remove_file(rel)
+                continue
+            if self.unchanged(rel, stat):
+                text = self.read_text(full, stat.st_size)
+            else:
+                # 索引之后文件又被修改过，顺便重新索引
+                text = self.index_file(rel, stat)
+            if text is not None and '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            if text is None or pattern not in text:
+                # 三元组都出现但连不成 pattern 的文件在这里排除，不必逐个字符比较
+                continue
+            line = 0
+            last = 0
+            for pos in bm.find_all(text):
+                line += text.count('\n', last, pos)
+                last = pos
+                begin = text.rfind('\n', 0, pos) + 1
+                end = text.find('\n', pos)
+                yield full, line, pos - begin, text[begin: end if end != -1 else len(text)]
+
+
+if __name__ == '__main__':
+    import time
+
+    index = FileIndex(sys.argv[1] if len(sys.argv) > 1 else '.')
+    start = time.perf_counter()
+    index.refresh()
+    print('%d files indexed in %.3fs' % (len(index), time.perf_counter() - start))
+    pattern = sys.argv[2] if len(sys.argv) > 2 else 'BoyerMoore'
+    start = time.perf_counter()
+    results = list(index.search(pattern))
+    print('%d matches in %.3fs' % (len(results), time.perf_counter() - start))
+    for path, line, column, text in results[:10]:
+        print('%s:%d:%d: %s' % (path, line + 1, column + 1, text.strip()))
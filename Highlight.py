@@ -1,5 +1,7 @@
 from PyQt5 import QtGui, QtWidgets, QtCore
 
+from AhoCorasick import AhoCorasick
+
 
 class Highlighter(QtGui.QSyntaxHighlighter):
 
@@ -26,6 +28,9 @@ class Highlighter(QtGui.QSyntaxHighlighter):
                              'slots', 'static', 'struct', 'template', 'typedef', 'typename', 'union', 'unsigned',
                              'virtual', 'void', 'volatile', 'bool']
         self.highlight_rules = []
+        # 关键字不再各用一个正则，而是合成一个自动机，每个文本块只扫描一遍
+        self.keywords = []
+        self.keyword_matcher = AhoCorasick()
         self.base_format = QtGui.QTextCharFormat()
         self.base_format.setFontFamily('fira_code')
         self.base_format.setFontPointSize(14)
@@ -39,11 +44,11 @@ class Highlighter(QtGui.QSyntaxHighlighter):
             self.highlight_python()
         elif language == 'cpp':
             self.highlight_cpp()
+        self.keyword_matcher = AhoCorasick.compile(tuple(self.keywords))
         self.rehighlight()
 
     def highlight_cpp(self):
-        for i in self.cpp_keywords:
-            self.highlight_rules.append((QtCore.QRegularExpression('\\b' + i + '\\b'), self.keyword_format))
+        self.keywords += self.cpp_keywords
 
         class_format = QtGui.QTextCharFormat(self.base_format)
         class_format.setFontWeight(QtGui.QFont.Bold)
@@ -71,8 +76,7 @@ class Highlighter(QtGui.QSyntaxHighlighter):
         multi_line_comment_format.setForeground(QtCore.Qt.red)
 
     def highlight_python(self):
-        for i in self.py_keywords + self.py_builtins + self.py_constants:
-            self.highlight_rules.append((QtCore.QRegularExpression('\\b' + i + '\\b'), self.keyword_format))
+        self.keywords += self.py_keywords + self.py_builtins + self.py_constants
 
         comment_format = QtGui.QTextCharFormat(self.base_format)
         comment_format.setForeground(QtCore.Qt.darkGreen)
@@ -83,6 +87,8 @@ class Highlighter(QtGui.QSyntaxHighlighter):
         prev_state = self.previousBlockState()
         self.setFormat(0, text_length, self.base_format)
 
+        for pos, keyword in self.keyword_matcher.find_all(text, whole_word=True):
+            self.setFormat(pos, len(keyword), self.keyword_format)
         for reg, format in self.highlight_rules:
             match_iterator = reg.globalMatch(text)
             while match_iterator.hasNext():
@@ -1,3 +1,5 @@
+import collections
+
 import six
 
 
@@ -111,41 +113,45 @@ class Huffman:
             self.preOrder(BT.right, code + '1')
 
     def encode(self, filename, language: str = None):
-        content = ''
-        with open(filename, 'r') as f:
-            lines = f.readlines()
-            for line in lines:
-                content += str(line)
+        def source():
+            with open(filename, 'r') as f:
+                for chunk in iter(lambda: f.read(1 << 16), ''):
+                    yield chunk
+
+        with open(filename.rsplit(sep='.', maxsplit=1)[0] + '.ac', 'wb') as f:
+            self.encode_chunks(source, f)
 
-        dict0 = {}
-        for ch in content:
-            dict0.setdefault(ch, 0)
-            dict0[ch] += 1
+    def encode_chunks(self, source, f):
+        # source() 每次调用都返回一个新的文本块迭代器：第一遍统计字频，第二遍逐块编码写入 f，
+        # 任何时候只保留一个块的编码结果
+        dict0 = collections.Counter()
+        for chunk in source():
+            dict0.update(chunk)
 
         self.buildHuffmanTree(dict0)
         self.preOrder(self.huffmanTree)
 
+        # 总位数可以由字频直接算出，补齐的位数写在文件头
         new = ''.join(list(self.dictionary.values()))
-        for ch in content:
-            new += self.dictionary[ch]
-        newSup = (8 - len(new) % 8)
-        new += '0' * newSup
+        total = len(new) + sum(len(self.dictionary[ch]) * n for ch, n in dict0.items())
+        newSup = (8 - total % 8)
 
-        f = open(filename.rsplit(sep='.', maxsplit=1)[0] + '.ac', 'wb')
         f.write(six.int2byte(newSup))
         f.write(six.int2byte(len(self.dictionary)))
         for v in self.dictionary.values():
             f.write(six.int2byte(len(v)))
         for k in self.dictionary.keys():
             f.write(six.int2byte(ord(k)))
-        for i in range(len(new) // 8):
-            # tmp = struct.pack('b', int(new[8 * i: 8 + 8 * i], 2))
-            # print(tmp)
-            # f.write(tmp)
-            f.write(six.int2byte(int(new[8 * i: 8 + 8 * i], 2)))
-            # print(int(new[8 * i: 8 + 8 * i], 2), end='\t')
-        f.flush()
-        f.close()
+
+        table = str.maketrans(self.dictionary)
+        for chunk in source():
+            new += chunk.translate(table)
+            n = len(new) // 8
+            if n:
+                f.write(int(new[:8 * n], 2).to_bytes(n, 'big'))
+                new = new[8 * n:]
+        new += '0' * newSup
+        f.write(int(new, 2).to_bytes(len(new) // 8, 'big'))
 
     def decode(self, filename):
         with open(filename, 'rb') as f:
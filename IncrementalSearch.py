@@ -0,0 +1,137 @@
+import bisect
+import time
+
+
+class IncrementalSearch:
+    # 边输入边查找。查询变长时只在上一次的匹配中筛选，退格时直接恢复之前的结果；
+    # 查找分成很多小步执行，每次只做一段时间，调用方可以在两次按键之间分几次完成
+    chunk_size = 1 << 14
+
+    def __init__(self, piece_table):
+        self.pt = piece_table
+        self.query = ''
+        self.matches = []  # 所有（可重叠的）匹配位置，递增；只有起点小于 scanned 的是完整的
+        self.scanned = 0
+        self.history = []  # 之前较短查询的 (query, matches, scanned)
+        self.work = None  # 尚未完成的查找
+        self.pt.add_listener(self.on_change)
+
+    def close(self):
+        self.pt.remove_listener(self.on_change)
+
+    def done(self):
+        return self.work is None
+
+    def update(self, query: str):
+        # 查询改变时调用，返回后再反复调用 step 直到 done()
+        if query == self.query:
+            return
+        while self.history and not query.startswith(self.history[-1][0]):
+            self.history.pop()
+        if self.query and query.startswith(self.query):
+            self.history.append((self.query, self.matches, self.scanned))
+        elif self.history and self.history[-1][0] == query:
+            # 退格回到了之前的查询
+            self.query, self.matches, self.scanned = self.history.pop()
+            self.work = None if self.scanned >= len(self.pt) else self.run([], self.scanned)
+            return
+        candidates, scanned = ([], 0)
+        if self.history:
+            # 新查询的匹配一定也是较短查询的匹配
+            _, candidates, scanned = self.history[-1]
+        self.query = query
+        self.matches = []
+        self.scanned = 0
+        self.work = self.run(candidates, scanned) if query else None
+
+    def step(self, budget: float = 0.01):
+        # 执行最多 budget 秒，查找完成时返回 True
+        if self.work is None:
+            return True
+        deadline = time.perf_counter() + budget
+        for _ in self.work:
+            if time.perf_counter() >= deadline:
+                return False
+        self.work = None
+        return True
+
+    def run(self, candidates, scanned: int):
+        # 起点在 scanned 之前的只检查 candidates 中的位置，之后的逐块扫描。
+        # 每块用 str.find 找出所有可重叠的匹配，匹配很多的短查询也不用逐个字符比较
+        query = self.query
+        m = len(query)
+        piece_table = self.pt.cur_piece_table
+        matches = self.matches
+        if len(candidates) * 64 < scanned:
+            # 候选很少时直接按位置读取，不必读完前面的全部文本
+            for i, pos in enumerate(candidates):
+                if self.text_at(piece_table, pos, m) == query:
+                    matches.append(pos)
+                if i % 256 == 255:
+                    self.scanned = pos + 1
+                    yield
+            self.scanned = base = scanned
+            candidates = []
+        else:
+            base = 0 if candidates else scanned
+        i = 0
+        carry = ''
+        for chunk in piece_table.iter_chunks(base, self.chunk_size, self.chunk_size):
+            window = carry + chunk
+            end = base + len(window) - m + 1  # 本块中能完整检查的起点上界
+            while i < len(candidates) and candidates[i] < min(end, scanned):
+                if window.startswith(query, candidates[i] - base):
+                    matches.append(candidates[i])
+                i += 1
+            if end > scanned:
+                j = window.find(query, max(scanned, base) - base)
+                while j != -1:
+                    matches.append(base + j)
+                    j = window.find(query, j + 1)
+            carry = window[max(0, len(window) - m + 1):]
+            base += len(window) - len(carry)
+            self.scanned = base
+            yield
+        self.scanned = len(piece_table)
+
+    def text_at(self, piece_table, pos: int, length: int):
+        if self.pt.sequence_table is piece_table:
+            return self.pt.sequence[pos: pos + length]
+        return ''.join(piece_table.iter_range(pos, pos + length))
+
+    def on_change(self, pos: int, removed: int, inserted: str):
+        # 文本修改后只重新查找受影响的区间，其余匹配平移
+        self.history = []
+        if not self.query:
+            return
+        if self.work is not None or self.pt.pending:
+            # 查找还没完成，或当前版本中还有没通知到的修改（apply_edits），按新版本重新开始
+            self.matches = []
+            self.scanned = 0
+            self.work = self.run([], 0)
+            return
+        m = len(self.query)
+        delta = len(inserted) - removed
+        lo = bisect.bisect_left(self.matches, pos - m + 1)
+        hi = bisect.bisect_left(self.matches, pos + removed)
+        begin = max(0, pos - m + 1)
+        end = pos + len(inserted) + m - 1
+        text = ''.join(self.pt.cur_piece_table.iter_range(begin, end))
+        found = []
+        j = text.find(self.query)
+        while j != -1:
+            found.append(begin + j)
+            j = text.find(self.query, j + 1)
+        self.matches[lo:] = found + [p + delta for p in self.matches[hi:]]
+        self.scanned = len(self.pt)
+
+    def next_match(self, pos: int):
+        # pos 之后（含）的第一个匹配，还没扫描到时返回 None，没有时返回 -1
+        i = bisect.bisect_left(self.matches, pos)
+        if i < len(self.matches) and self.matches[i] < self.scanned:
+            return self.matches[i]
+        return -1 if self.work is None else None
+
+    def matches_in(self, begin: int, end: int):
+        # [begin, end) 中开始的匹配
+        return self.matches[bisect.bisect_left(self.matches, begin): bisect.bisect_left(self.matches, end)]
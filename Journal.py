@@ -0,0 +1,131 @@
+import os
+import struct
+
+from PieceTable import PieceTable
+
+EDIT = 0
+UNDO = 1
+REDO = 2
+MERGE = 0x80  # 修改并入了上一个撤销步骤
+
+
+class Journal:
+    # 追加写入的二进制撤销日志：文件头记录原文件的大小和修改时间，之后每条记录为
+    # (操作, 位置, 删除长度, 插入文本的字节数) 加上 UTF-8 编码的插入文本。
+    # 撤销和重做也记下它们造成的修改，日志在保存时重新开始后仍能准确重放内容
+    magic = b'ACJ1'
+    header = struct.Struct('<4sqq')
+    record = struct.Struct('<BQII')
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    @staticmethod
+    def path_of(filename):
+        # 与文档放在同一目录下的隐藏文件
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        return os.path.join(dirname, '.' + basename + '.acj')
+
+    @staticmethod
+    def stat_of(filename):
+        if filename and os.path.exists(filename):
+            stat = os.stat(filename)
+            return stat.st_size, stat.st_mtime_ns
+        return 0, 0
+
+    def start(self, filename=None):
+        # 以 filename 当前的内容为起点重新开始记录
+        self.close()
+        self.file = open(self.path, 'wb')
+        self.file.write(self.header.pack(self.magic, *self.stat_of(filename)))
+        self.file.flush()
+
+    def resume(self):
+        # 在已有日志的末尾继续追加
+        self.close()
+        self.file = open(self.path, 'ab')
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        # 未保存的修改被放弃，日志也不再需要
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def matches(self, filename=None):
+        # 日志是否正是基于 filename 当前的内容记录的
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(self.header.size)
+        except OSError:
+            return False
+        if len(data) < self.header.size:
+            return False
+        magic, size, mtime = self.header.unpack(data)
+        return magic == self.magic and (size, mtime) == self.stat_of(filename)
+
+    def empty(self):
+        # 日志中没有任何修改记录
+        return next(self.records(), None) is None
+
+    def append(self, op: int, pos: int = 0, removed: int = 0, data: bytes = b''):
+        if self.file:
+            self.file.write(self.record.pack(op, pos, removed, len(data)) + data)
+            self.file.flush()
+
+    def record_edit(self, pos: int, removed: int, inserted: str, merge: bool):
+        self.append(EDIT | (MERGE if merge else 0), pos, removed, inserted.encode('utf-8'))
+
+    def record_undo(self, pos: int, removed: int, inserted: str):
+        self.append(UNDO, pos, removed, inserted.encode('utf-8'))
+
+    def record_redo(self, pos: int, removed: int, inserted: str):
+        self.append(REDO, pos, removed, inserted.encode('utf-8'))
+
+    def records(self):
+        with open(self.path, 'rb') as f:
+            f.read(self.header.size)
+            while True:
+                head = f.read(self.record.size)
+                if len(head) < self.record.size:
+                    break
+                op, pos, removed, length = self.record.unpack(head)
+                data = f.read(length)
+                if len(data) < length:  # 崩溃时写了一半的记录
+                    break
+                yield op, pos, removed, data.decode('utf-8')
+
+    def replay(self, piece_table):
+        # 把日志中的操作重新作用到基于原文件内容创建的 piece_table 上
+        # 撤销/重做的目标不在重放出的历史中时（日志开始之前的历史），按普通修改处理
+        for op, pos, removed, text in self.records():
+            kind = op & ~MERGE
+            change = (pos, removed, text)
+            if kind == UNDO and piece_table.undo_change() == change:
+                piece_table.undo()
+            elif kind == REDO and piece_table.redo_change() == change:
+                piece_table.redo()
+            else:
+                merge = kind == EDIT and bool(op & MERGE) and piece_table.snaps > 0
+                if removed:
+                    piece_table.delete(pos, pos + removed - 1, merge)
+                    merge = True
+                if text:
+                    piece_table.insert(pos, text, merge)
+        piece_table.typing = None
+        return piece_table
+
+    def restore(self, text='', **kwargs):
+        # 重建带有完整撤销历史的 PieceTable，并继续在本日志后追加；
+        # 传入更大的 max_history 即可把内存中已丢弃的旧历史重新载入
+        piece_table = self.replay(PieceTable(text, **kwargs))
+        self.resume()
+        piece_table.journal = self
+        return piece_table
@@ -0,0 +1,168 @@
+import bisect
+import codecs
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+
+class MappedBuffer:
+    # 以 mmap 方式映射的只读原始缓冲区，按块解码，接口与 TextBuffer 相同。
+    # 各块的字符偏移和换行符个数在第一次读到该块时才计算，只读开头几行时不必扫描整个文件；
+    # 块的边界按 UTF-8 的字符边界确定，所以只支持 UTF-8
+    block_size = 1 << 20
+    cache_blocks = 8
+
+    def __init__(self, filename, encoding='utf-8'):
+        if codecs.lookup(encoding).name != 'utf-8':
+            raise ValueError('MappedBuffer only supports UTF-8, not %r' % encoding)
+        self.filename = filename
+        self.encoding = 'utf-8'
+        self.file = open(filename, 'rb')
+        self.stat = os.fstat(self.file.fileno())
+        self.size = self.stat.st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.blocks = OrderedDict()  # 最近解码的块：块号 -> [文本, 换行符偏移]
+        self.lock = threading.Lock()  # 快照可能在其他线程中读取
+
+        # 已索引各块的起始字节偏移、起始字符偏移和之前的换行符总数，最后一项为已索引部分的末尾
+        self.byte_offsets = [0]
+        self.char_offsets = [0]
+        self.lf_offsets = [0]
+
+    def __len__(self):
+        self.index_all()
+        return self.char_offsets[-1]
+
+    def index_next(self):
+        # 索引下一块，已全部索引时返回 False
+        with self.lock:
+            begin = self.byte_offsets[-1]
+            if begin >= self.size:
+                return False
+            end = min(begin + self.block_size, self.size)
+            while end < self.size and 0x80 <= self.data[end] < 0xC0:  # 不在 UTF-8 字符中间切开
+                end -= 1
+            data = self.data[begin: end]
+            if data.isascii():
+                # 纯 ASCII 的块不必解码
+                length = len(data)
+                line_feeds = data.count(b'\n')
+            else:
+                text = data.decode(self.encoding)
+                length = len(text)
+                line_feeds = text.count('\n')
+            self.char_offsets.append(self.char_offsets[-1] + length)
+            self.lf_offsets.append(self.lf_offsets[-1] + line_feeds)
+            self.byte_offsets.append(end)
+            return True
+
+    def index_all(self):
+        while self.index_next():
+            pass
+
+    def index_to(self, pos: int):
+        # 索引到包含字符 pos 的块为止
+        while self.char_offsets[-1] <= pos and self.index_next():
+            pass
+
+    def line_start(self, line: int):
+        # 第 line 行（从 0 开始）的起始位置，超出末行时为文件末尾；只索引到该行所在的块
+        if line <= 0:
+            return 0
+        while self.lf_offsets[-1] < line and self.index_next():
+            pass
+        if self.lf_offsets[-1] < line:
+            return self.char_offsets[-1]
+        return self.find_line_feed(0, line - 1) + 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop = item.start or 0, item.stop
+            if item.step not in (None, 1) or start < 0 or stop is None or stop < 0:
+                # 需要从末尾算起时才索引整个文件
+                start, stop, _ = item.indices(len(self))
+            else:
+                self.index_to(stop - 1)
+                stop = min(stop, self.char_offsets[-1])
+            parts = []
+            i = self.block_of(start)
+            while start < stop:
+                text = self.get_block(i)[0]
+                begin = self.char_offsets[i]
+                end = min(stop, self.char_offsets[i + 1])
+                parts.append(text[start - begin: end - begin])
+                start = end
+                i += 1
+            return ''.join(parts)
+        if item < 0:
+            item += len(self)
+        self.index_to(item)
+        if not 0 <= item < self.char_offsets[-1]:
+            raise IndexError('MappedBuffer index out of range')
+        i = self.block_of(item)
+        return self.get_block(i)[0][item - self.char_offsets[i]]
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def unchanged(self):
+        # 路径上的文件是否仍是映射的这一个，保存时改名替换后其他进程按路径打开的就是新文件了
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_dev, stat.st_size, stat.st_mtime_ns) == \
+            (self.stat.st_ino, self.stat.st_dev, self.stat.st_size, self.stat.st_mtime_ns)
+
+    def block_of(self, pos: int):
+        self.index_to(pos)
+        return max(0, min(bisect.bisect_right(self.char_offsets, pos) - 1, len(self.char_offsets) - 2))
+
+    def get_block(self, i: int):
+        with self.lock:
+            block = self.blocks.get(i)
+            if block is None:
+                text = self.data[self.byte_offsets[i]: self.byte_offsets[i + 1]].decode(self.encoding)
+                block = self.blocks[i] = [text, None]
+                if len(self.blocks) > self.cache_blocks:
+                    self.blocks.popitem(last=False)
+            else:
+                self.blocks.move_to_end(i)
+            return block
+
+    def block_line_feeds(self, i: int):
+        block = self.get_block(i)
+        if block[1] is None:
+            text = block[0]
+            line_feeds = []
+            j = text.find('\n')
+            while j != -1:
+                line_feeds.append(j)
+                j = text.find('\n', j + 1)
+            block[1] = line_feeds
+        return block[1]
+
+    def line_feeds_before(self, pos: int):
+        i = self.block_of(pos)
+        if len(self.char_offsets) < 2:
+            return 0
+        return self.lf_offsets[i] + bisect.bisect_left(self.block_line_feeds(i), pos - self.char_offsets[i])
+
+    def count_line_feeds(self, start: int, end: int):
+        # [start, end) 内换行符的个数
+        if start >= end:
+            return 0
+        return self.line_feeds_before(end) - self.line_feeds_before(start)
+
+    def find_line_feed(self, start: int, k: int):
+        # start 之后第 k 个换行符（从 0 开始计）的偏移
+        n = self.line_feeds_before(start) + k
+        while self.lf_offsets[-1] <= n and self.index_next():
+            pass
+        if n >= self.lf_offsets[-1]:
+            raise IndexError('MappedBuffer line feed out of range')
+        i = bisect.bisect_right(self.lf_offsets, n) - 1
+        return self.char_offsets[i] + self.block_line_feeds(i)[n - self.lf_offsets[i]]
@@ -0,0 +1,132 @@
+import mmap
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from BoyerMoore import BoyerMoore
+from MappedBuffer import MappedBuffer
+from PieceTree import ORIGINAL
+
+
+def search_text(pattern, text, base, lo=0, hi=None):
+    # 在子进程中执行：返回 text 中所有（可重叠的）匹配在全文中的位置 base + j，
+    # 只保留完整落在 text 的 [lo, hi) 内的匹配
+    if hi is None:
+        hi = len(text)
+    m = len(pattern)
+    return [base + j for j in BoyerMoore.compile(pattern).find_all(text, lo, True) if j + m <= hi]
+
+
+def search_mapped(pattern, filename, encoding, byte_begin, byte_end, byte_stop, keep, base, lo, hi):
+    # 在子进程中执行：自己映射原文件，解码 [byte_begin, byte_end) 以及其后的 keep 个字符再查找
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[byte_begin: byte_end].decode(encoding)
+        if keep:
+            text += data[byte_end: byte_stop].decode(encoding)[:keep]
+    return search_text(pattern, text, base, lo, hi)
+
+
+class ParallelSearch:
+    # 把文本切成相互重叠 m - 1 个字符的块，交给多个进程同时查找，再按顺序合并结果
+    min_size = 4 << 20  # 小于此长度时进程间传递的开销比查找本身还大，直接串行查找
+    chunk_size = 4 << 20
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            # 编辑器进程中有 Qt 的线程和窗口状态，fork 出的子进程可能卡死；spawn 的子进程只导入本模块
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def find_all(self, piece_table, pattern: str, begin: int = 0, overlapping=False):
+        # 返回 piece_table（PieceTree 的某个版本）中从 begin 开始所有匹配位置的列表
+        begin = max(0, begin)
+        if not pattern or self.workers < 2 or len(piece_table) - begin < self.min_size:
+            return self.find_all_serial(piece_table, pattern, begin, overlapping)
+        try:
+            tasks = self.mapped_tasks(piece_table, pattern, begin)
+            if tasks is None:
+                tasks = self.text_tasks(piece_table, pattern, begin)
+            matches = self.run(tasks)
+        except (OSError, BrokenProcessPool):
+            # 无法创建子进程等情况下退回串行查找
+            self.close()
+            return self.find_all_serial(piece_table, pattern, begin, overlapping)
+        if not overlapping:
+            # 各块给出的是全部可重叠的匹配，从左到右贪心选取即与串行查找的结果相同
+            selected = []
+            end = 0
+            for pos in matches:
+                if pos >= end:
+                    selected.append(pos)
+                    end = pos + len(pattern)
+            matches = selected
+        return matches
+
+    @staticmethod
+    def find_all_serial(piece_table, pattern: str, begin: int = 0, overlapping=False):
+        bm = BoyerMoore.compile(pattern)
+        return list(bm.find_all_chunks(piece_table.iter_chunks(begin), begin, overlapping))
+
+    def run(self, tasks):
+        # 同时提交的任务不超过进程数的两倍，已提交但还没处理的文本块不会占用太多内存
+        executor = self.get_executor()
+        pending = deque()
+        matches = []
+        for task in tasks:
+            pending.append(executor.submit(*task))
+            if len(pending) >= 2 * self.workers:
+                matches += pending.popleft().result()
+        while pending:
+            matches += pending.popleft().result()
+        return matches
+
+    def text_tasks(self, piece_table, pattern: str, begin: int):
+        # 按块取出文本，每块前面带上上一块末尾的 m - 1 个字符，跨块的匹配只会在后一块中找到
+        keep = len(pattern) - 1
+        carry = ''
+        base = begin
+        for chunk in piece_table.iter_chunks(begin, self.chunk_size, self.chunk_size):
+            text = carry + chunk
+            yield search_text, pattern, text, base
+            carry = text[max(0, len(text) - keep):]
+            base += len(text) - len(carry)
+
+    def mapped_tasks(self, piece_table, pattern: str, begin: int):
+        # 未经修改的 mmap 文件由子进程自己映射读取，不需要传递文本；其他情况返回 None
+        root = piece_table.root
+        if root is None or root.left or root.right or root.piece.buffer != ORIGINAL:
+            return None
+        buffer = piece_table.buffers[ORIGINAL]
+        if not isinstance(buffer, MappedBuffer) or not buffer.unchanged():
+            return None
+        return self.iter_mapped_tasks(buffer, root.piece, pattern, begin)
+
+    def iter_mapped_tasks(self, buffer, piece, pattern: str, begin: int):
+        buffer.index_all()
+        keep = len(pattern) - 1
+        lo = piece.start + begin  # 缓冲区中要查找的字符区间
+        hi = piece.start + piece.length
+        blocks = max(1, self.chunk_size // buffer.block_size)
+        last = len(buffer.char_offsets) - 1
+        i = buffer.block_of(lo)
+        while i < last and buffer.char_offsets[i] < hi:
+            k = min(i + blocks, last)
+            base = buffer.char_offsets[i]
+            byte_stop = buffer.byte_offsets[min(k + 1, last)]
+            yield (search_mapped, pattern, buffer.filename, buffer.encoding, buffer.byte_offsets[i],
+                   buffer.byte_offsets[k], byte_stop, keep, base - piece.start, max(0, lo - base), hi - base)
+            i = k
+
+
+default_search = ParallelSearch()
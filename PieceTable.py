@@ -1,150 +1,635 @@
-from copy import deepcopy
+import bisect
+import os
+import tempfile
+import time
+from contextlib import contextmanager
 
+from AhoCorasick import AhoCorasick
 from BoyerMoore import BoyerMoore
+from MappedBuffer import MappedBuffer
+from ParallelSearch import default_search
+from PieceTree import ADD, ORIGINAL, Piece, PieceTree
+from SearchPattern import SearchPattern
+from TextBuffer import TextBuffer
 
 
-class PieceTable:
+class Searchable:
+    # PieceTable 与 Snapshot 共用的查找方法。子类提供 tree()（要查找的 PieceTree 版本）、
+    # cached_sequence()（与该版本一致的全文缓存，没有时为 None）和 get_sequence()
 
-    def __init__(self, text=''):
-        self.original_buffer = text
-        self.add_buffer = ''
-        self.cur_piece_table = []
-        descriptor = {'buffer': 'original', 'start': 0, 'length': len(text)}
-        self.cur_piece_table.append(descriptor)
-        self.piece_tables = [deepcopy(self.cur_piece_table)]
+    def find(self, pattern: str, begin: int = 0):
+        for index in self.find_all(pattern, begin):
+            return index
+        return -1
+
+    def find_all(self, pattern: str, begin: int = 0, overlapping=False):
+        # 依次返回所有匹配的位置，位置以调用时的版本为准，迭代期间的修改不影响结果。
+        # 全文缓存有效时直接在缓存中查找，否则逐块扫描 piece，不拼接全文，查找下一个只读到匹配处
+        bm = BoyerMoore.compile(pattern)
+        begin = max(0, begin)
+        sequence = self.cached_sequence()
+        if sequence is not None:
+            return bm.find_all(sequence, begin, overlapping)
+        return bm.find_all_chunks(self.tree().iter_chunks(begin), begin, overlapping)
+
+    def find_all_parallel(self, pattern: str, begin: int = 0, overlapping=False, search=None):
+        # 一次返回所有匹配位置的列表，很长的文本分块交给多个进程查找，较短时自动串行查找
+        if search is None:
+            search = default_search
+        return search.find_all(self.tree(), pattern, begin, overlapping)
+
+    def count(self, pattern: str, begin: int = 0, overlapping=False):
+        sequence = self.cached_sequence()
+        if sequence is not None:
+            return BoyerMoore.compile(pattern).count(sequence, begin, overlapping)
+        return sum(1 for _ in self.find_all(pattern, begin, overlapping))
+
+    def search(self, pattern: str, begin: int = 0, regex=False, ignore_case=False, whole_word=False):
+        # 按查找选项返回第一个匹配 (位置, 长度)，没有时返回 (-1, 0)
+        for match in self.search_all(pattern, begin, regex, ignore_case, whole_word):
+            return match
+        return -1, 0
+
+    def search_all(self, pattern: str, begin: int = 0, regex=False, ignore_case=False, whole_word=False):
+        # 依次返回互不重叠的匹配 (位置, 长度)。普通查找在 piece 上进行，正则等模式需要连续的全文
+        search_pattern = SearchPattern.compile(pattern, regex, ignore_case, whole_word)
+        if search_pattern.bm:
+            return ((index, len(pattern)) for index in self.find_all(pattern, begin))
+        return search_pattern.find_all(self.get_sequence(), begin)
+
+    def find_any(self, patterns, begin: int = 0):
+        # 任意一个模式串最先出现的 (位置, 模式串)，没有时返回 (-1, '')
+        return AhoCorasick.compile(tuple(patterns)).search(self.get_sequence(), begin)
+
+    def find_all_any(self, patterns, begin: int = 0, whole_word=False, overlapping=True):
+        return AhoCorasick.compile(tuple(patterns)).find_all(self.get_sequence(), begin, whole_word=whole_word,
+                                                             overlapping=overlapping)
+
+
+class PieceTable(Searchable):
+    # apply_edits 中一处修改做路径复制的开销，约与重建 splice_cost * log2(piece 数) 个 piece 相当
+    splice_cost = 2
+
+    def __init__(self, text='', max_patches=8, coalesce_interval=1.0, max_history=None):
+        # text 也可以是 MappedBuffer，此时原始内容按需从文件中读取
+        self.original_buffer = TextBuffer(text) if isinstance(text, str) else text
+        self.add_buffer = TextBuffer()
+        self.buffers = [self.original_buffer, self.add_buffer]  # 按 Piece.buffer 标记下标
+        descriptor = Piece(ORIGINAL, 0, len(self.original_buffer))
+        self.cur_piece_table = PieceTree(self.buffers).insert(0, descriptor)
+        self.piece_tables = [self.cur_piece_table]
+        # spans[i] = (起点, 旧终点, 新终点)：版本 i-1 到版本 i 之间被修改的区间
+        self.spans = [None]
         self.snaps = 0
+        if max_history is not None and max_history < 0:
+            raise ValueError('max_history must be None or >= 0')
+        self.max_history = max_history  # 最多保留的撤销步数，None 表示不限
 
-    def get_sequence(self):
-        text = ''
-        for i in range(len(self.cur_piece_table)):
-            if not self.cur_piece_table[i]:
-                continue
-            start = self.cur_piece_table[i]['start']
-            length = self.cur_piece_table[i]['length']
-            if self.cur_piece_table[i]['buffer'] == 'original':
-                text += self.original_buffer[start: start + length]
-            elif self.cur_piece_table[i]['buffer'] == 'add':
-                text += self.add_buffer[start: start + length]
-        return text
-
-    def delete(self, begin: int, end: int):
-        pointer = -1
-        index1 = 0
-        index2 = 0
-        len1 = 0
-        len2 = 0
-        new_piece_table = []
-
-        for i in range(len(self.cur_piece_table)):
-            pointer += self.cur_piece_table[i]['length']
-            if begin <= pointer:
-                index1 = i
-                len1 = begin - (pointer - self.cur_piece_table[i]['length'] + 1)
-                break
+        # 事务嵌套深度，以及当前事务是否已经产生了历史版本
+        self.batch = 0
+        self.batch_open = False
 
-        pointer = -1
-        for i in range(len(self.cur_piece_table)):
-            pointer += self.cur_piece_table[i]['length']
-            if end <= pointer:
-                index2 = i
-                len2 = pointer - end
-                break
+        # 连续输入的单个字符合并为一个撤销步骤：(版本, 结束位置, 上一个字符, 时间)
+        self.coalesce_interval = coalesce_interval
+        self.typing = None
 
-        new_piece_table.extend(deepcopy(self.cur_piece_table[:index1]))
+        # 缓存的全文及其对应的版本，dirty 中记录此后尚未打到缓存上的修改
+        self.max_patches = max_patches
+        self.sequence = text if isinstance(text, str) else None
+        self.sequence_table = self.dirty_table = self.cur_piece_table if self.sequence is not None else None
+        self.dirty = []
 
-        descriptor1 = deepcopy(self.cur_piece_table[index1])
-        descriptor1['length'] = len1
-        new_piece_table.append(deepcopy(descriptor1))
+        # 修改监听者，回调参数为 (位置, 删除长度, 插入文本)
+        self.listeners = []
+        # apply_edits 通知监听者时，当前版本中已包含、但还没通知到的修改数；不为 0 时当前版本与已收到的修改对不上
+        self.pending = 0
+        self.journal = None  # 可选的磁盘撤销日志，见 Journal
 
-        descriptor2 = deepcopy(self.cur_piece_table[index2])
-        descriptor2['start'] = descriptor2['start'] + descriptor2['length'] - len2
-        descriptor2['length'] = len2
-        new_piece_table.append(deepcopy(descriptor2))
+    @classmethod
+    def from_file(cls, filename, encoding='utf-8', **kwargs):
+        # 用 mmap 打开文件，不把全文读入内存
+        return cls(MappedBuffer(filename, encoding), **kwargs)
 
-        new_piece_table.extend(deepcopy(self.cur_piece_table[index2 + 1:]))
-        self.piece_tables.append(deepcopy(new_piece_table))
-        self.snaps += 1
-        self.cur_piece_table = self.piece_tables[self.snaps]
+    def __len__(self):
+        return len(self.cur_piece_table)
+
+    def close(self):
+        if isinstance(self.original_buffer, MappedBuffer):
+            self.original_buffer.close()
+
+    def tree(self):
+        return self.cur_piece_table
+
+    def cached_sequence(self):
+        return self.sequence if self.sequence_table is self.cur_piece_table else None
+
+    def get_buffer(self, piece):
+        return self.buffers[piece.buffer]
+
+    def build_sequence(self, piece_table):
+        buffers = self.buffers
+        return ''.join([buffers[piece.buffer][piece.start: piece.start + piece.length] for piece in piece_table])
 
-        return self.get_sequence()
-
-    def insert(self, pos: int, text: str):
-        pointer = -1
-        index = -1
-        len1 = 0
-        len2 = 0
-        new_piece_table = []
-
-        for i in range(len(self.cur_piece_table)):
-            pointer += self.cur_piece_table[i]['length']
-            if pos <= pointer:
-                index = i
-                len1 = pos - (pointer - self.cur_piece_table[i]['length'] + 1)
-                len2 = pointer - pos + 1
+    def get_sequence(self):
+        if self.sequence_table is not self.cur_piece_table:
+            if self.dirty and self.dirty_table is self.cur_piece_table:
+                text = self.patch_sequence(self.sequence, self.dirty)
+            else:
+                text = self.build_sequence(self.cur_piece_table)
+            self.sequence = text
+            self.sequence_table = self.dirty_table = self.cur_piece_table
+            self.dirty = []
+        return self.sequence
+
+    @staticmethod
+    def patch_sequence(text, patches):
+        # 依次打上 patches。先把补丁合并为新全文的分段：(起点, 终点) 为 text 中的区间，str 为插入的文本，
+        # 每个补丁只处理 O(补丁数) 个分段，最后只拼接一次全文，而不是每个补丁复制一遍全文
+        segments = [(0, len(text))]
+        for pos, removed, inserted in patches:
+            after = PieceTable.cut_segments(segments, pos + removed)
+            segments = PieceTable.cut_segments(segments, 0, pos)
+            if inserted:
+                segments.append(inserted)
+            segments += after
+        return ''.join([segment if isinstance(segment, str) else text[segment[0]: segment[1]]
+                        for segment in segments])
+
+    @staticmethod
+    def cut_segments(segments, begin: int, end: int = None):
+        # 分段表示的文本中 [begin, end) 的部分，end 为 None 时到末尾
+        result = []
+        offset = 0
+        for segment in segments:
+            if end is not None and offset >= end:
                 break
+            if isinstance(segment, str):
+                length = len(segment)
+            else:
+                length = segment[1] - segment[0]
+            lo = max(begin - offset, 0)
+            hi = length if end is None else min(end - offset, length)
+            if lo < hi:
+                if isinstance(segment, str):
+                    result.append(segment[lo: hi])
+                else:
+                    result.append((segment[0] + lo, segment[0] + hi))
+            offset += length
+        return result
 
-        if index == -1:
-            new_piece_table.extend(deepcopy(self.cur_piece_table))
-            descriptor = {'buffer': 'add', 'start': len(self.add_buffer), 'length': len(text)}
-            self.add_buffer += text
-            new_piece_table.append(deepcopy(descriptor))
+    def mark_dirty(self, piece_table, pos: int, removed: int, inserted: str):
+        if self.dirty_table is not self.cur_piece_table or len(self.dirty) >= self.max_patches:
+            self.dirty = []
+            self.dirty_table = None
+            return
+        self.dirty.append((pos, removed, inserted))
+        self.dirty_table = piece_table
+
+    def push_snap(self, piece_table, span, merge=False):
+        # 各版本共享未改动的节点，每个历史版本只多出 O(log n) 个节点
+        # 事务中的修改合并为同一个历史版本
+        merge = merge or (self.batch and self.batch_open)
+        if merge and self.spans[self.snaps] is None:
+            # 要并入的步骤已因 max_history 被丢弃（max_history 为 0 时总是如此），只能作为新的一步
+            merge = False
+        if merge:
+            del self.piece_tables[self.snaps + 1:]
+            del self.spans[self.snaps + 1:]
+            self.piece_tables[self.snaps] = piece_table
+            self.spans[self.snaps] = self.merge_span(self.spans[self.snaps], span)
         else:
-            new_piece_table.extend(deepcopy(self.cur_piece_table[: index]))
-            descriptor1 = deepcopy(self.cur_piece_table[index])
-            descriptor1['length'] = len1
-            new_piece_table.append(deepcopy(descriptor1))
-            descriptor2 = {'buffer': 'add', 'start': len(self.add_buffer), 'length': len(text)}
-            self.add_buffer += text
-            new_piece_table.append(deepcopy(descriptor2))
-            descriptor3 = deepcopy(self.cur_piece_table[index])
-            descriptor3['start'] = descriptor3['start'] + len1
-            descriptor3['length'] = len2
-            new_piece_table.append(deepcopy(descriptor3))
-            new_piece_table.extend(deepcopy(self.cur_piece_table[index + 1:]))
-
-        self.piece_tables.append(deepcopy(new_piece_table))
-        self.snaps += 1
-        self.cur_piece_table = self.piece_tables[self.snaps]
+            del self.piece_tables[self.snaps + 1:]
+            del self.spans[self.snaps + 1:]
+            self.piece_tables.append(piece_table)
+            self.spans.append(span)
+            self.snaps += 1
+            self.batch_open = self.batch > 0
+            if self.max_history is not None and self.snaps > self.max_history:
+                self.drop_history(self.snaps - self.max_history)
+        self.cur_piece_table = piece_table
+        return merge
+
+    def drop_history(self, count: int):
+        del self.piece_tables[:count]
+        del self.spans[:count]
+        self.spans[0] = None
+        self.snaps -= count
+
+    @staticmethod
+    def merge_span(span, new_span):
+        # 在 span 之后又修改了 new_span（均为修改后的坐标），返回两次修改合起来的区间
+        begin, old_end, new_end = span
+        pos, removed_end, inserted_end = new_span
+        return (min(begin, pos), old_end + max(0, removed_end - new_end),
+                max(new_end, removed_end) - removed_end + inserted_end)
+
+    def change(self, piece_table, pos: int, removed: int, inserted: str, merge=False):
+        # 提交一次修改：记录缓存补丁和历史版本，并通知监听者
+        self.mark_dirty(piece_table, pos, removed, inserted)
+        merge = self.push_snap(piece_table, (pos, pos + removed, pos + len(inserted)), merge)
+        if self.journal:
+            self.journal.record_edit(pos, removed, inserted, merge)
+        self.emit(pos, removed, inserted)
+
+    def switch(self, piece_table, pos: int, removed: int, inserted: str):
+        # 撤销/重做时切换到另一个版本，(pos, removed, inserted) 为两版本间的差异
+        self.mark_dirty(piece_table, pos, removed, inserted)
+        self.cur_piece_table = piece_table
+        self.emit(pos, removed, inserted)
 
-        return self.get_sequence()
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def emit(self, pos: int, removed: int, inserted: str):
+        for listener in self.listeners:
+            listener(pos, removed, inserted)
+
+    @contextmanager
+    def transaction(self):
+        # with pt.transaction(): 其中的所有修改只产生一个撤销步骤
+        self.batch += 1
+        try:
+            yield self
+        finally:
+            self.batch -= 1
+            if not self.batch:
+                self.batch_open = False
+
+    def delete(self, begin: int, end: int, merge=False):
+        begin = max(0, begin)
+        end = min(end, len(self.cur_piece_table) - 1)
+        if begin > end:
+            return
+
+        self.change(self.cur_piece_table.delete(begin, end + 1), begin, end - begin + 1, '', merge)
+
+    def insert(self, pos: int, text: str, merge=None):
+        # merge 为 None 时根据是否连续输入自动决定是否并入上一个撤销步骤
+        if not text:
+            return
+
+        pos = max(0, min(pos, len(self.cur_piece_table)))
+        now = time.time()
+        if merge is None:
+            # 事务中的修改自成一个撤销步骤，不并入事务之前的输入
+            merge = not self.batch and self.continues_typing(pos, text, now)
+        piece_table = None
+        if pos > 0:
+            # 紧接在上一次追加的内容之后插入时，直接延长那个 piece
+            piece, offset = self.cur_piece_table.find(pos - 1)
+            if piece.buffer == ADD and offset == piece.length - 1 \
+                    and piece.start + piece.length == len(self.add_buffer):
+                self.add_buffer.append(text)
+                piece_table = self.cur_piece_table.extend(pos, len(text))
+        if piece_table is None:
+            descriptor = Piece(ADD, len(self.add_buffer), len(text))
+            self.add_buffer.append(text)
+            piece_table = self.cur_piece_table.insert(pos, descriptor)
+        self.change(piece_table, pos, 0, text, merge)
+        self.typing = (piece_table, pos + 1, text, now) if len(text) == 1 else None
+
+    def continues_typing(self, pos: int, text: str, now: float):
+        # 在上一个输入的字符之后继续输入，且未超时、未遇到换行或新单词的开头
+        if len(text) != 1 or self.typing is None:
+            return False
+        piece_table, end, last, last_time = self.typing
+        if piece_table is not self.cur_piece_table or end != pos or now - last_time > self.coalesce_interval:
+            return False
+        return text != '\n' and not (last.isspace() and not text.isspace())
 
     def copy(self, from_begin: int, from_end: int, to: int):
         s = self.subsequence(from_begin, from_end)
         self.insert(to, s)
-        return self.get_sequence()
 
     def move(self, from_begin: int, from_end: int, to: int):
         s = self.subsequence(from_begin, from_end)
-        self.delete(from_begin, from_end)
-        self.insert(to, s)
-        return self.get_sequence()
+        with self.transaction():
+            self.delete(from_begin, from_end)
+            self.insert(to, s)
 
     def replace(self, from_begin: int, from_end: int, text: str):
-        self.delete(from_begin, from_end)
-        self.insert(from_begin, text)
-        return self.get_sequence()
+        with self.transaction():
+            self.delete(from_begin, from_end)
+            self.insert(from_begin, text)
 
-    def find(self, pattern: str, begin: int = 0):
-        bm = BoyerMoore(self.get_sequence(), pattern)
-        return bm.boyer_moore(begin)
+    def apply_edits(self, edits):
+        # 同时应用多处修改 (位置, 删除长度, 插入文本)，位置都以修改前的文本为准，区间不能重叠，
+        # 同一位置的多个插入按给出的顺序排列，并位于从该位置开始删除的区间之前。整体只产生一个撤销步骤，
+        # 监听者和撤销日志按从后往前的顺序逐处收到修改，前面的位置不受影响。
+        # 修改不多时逐处做 O(log n) 的路径复制，新版本与旧版本共享其余节点；
+        # 修改很多（例如全部替换）时只遍历一遍旧版本的 piece，拼出新的 piece 序列后 O(n) 建树
+        edits = sorted(edits, key=lambda edit: (edit[0], edit[1] > 0))
+        length = len(self.cur_piece_table)
+        for i, (pos, removed, _) in enumerate(edits):
+            end = edits[i + 1][0] if i + 1 < len(edits) else length
+            if pos < 0 or removed < 0 or pos + removed > end:
+                raise ValueError('edits overlap or out of range')
+        edits = [edit for edit in edits if edit[1] or edit[2]]
+        if not edits:
+            return
+        pieces = self.cur_piece_table.piece_count()
+        if len(edits) * pieces.bit_length() * self.splice_cost < pieces:
+            with self.transaction():
+                for pos, removed, text in reversed(edits):
+                    piece_table = self.cur_piece_table.delete(pos, pos + removed)
+                    if text:
+                        descriptor = Piece(ADD, len(self.add_buffer), len(text))
+                        self.add_buffer.append(text)
+                        piece_table = piece_table.insert(pos, descriptor)
+                    self.change(piece_table, pos, removed, text)
+            self.typing = None
+            return
+
+        # 所有插入的文本一次追加到 add_buffer 末尾
+        add_start = len(self.add_buffer)
+        self.add_buffer.append(''.join(text for _, _, text in edits))
+        piece_table = PieceTree.from_pieces(self.splice_pieces(edits, add_start), self.buffers)
+
+        first, old_end = edits[0][0], edits[-1][0] + edits[-1][1]
+        new_end = old_end + len(piece_table) - length
+        sequence = self.cached_sequence()
+        if self.dirty_table is self.cur_piece_table and len(self.dirty) + len(edits) <= self.max_patches:
+            # 从后往前打补丁，与逐处修改时相同
+            self.dirty.extend(reversed(edits))
+            self.dirty_table = piece_table
+        elif sequence is not None:
+            # 修改很多但全文缓存有效时顺便拼出新的全文，之后的查找仍直接在缓存中进行
+            parts = []
+            copied = 0
+            for pos, removed, text in edits:
+                parts.append(sequence[copied: pos])
+                parts.append(text)
+                copied = pos + removed
+            parts.append(sequence[copied:])
+            self.sequence = ''.join(parts)
+            self.sequence_table = self.dirty_table = piece_table
+            self.dirty = []
+        else:
+            self.dirty = []
+            self.dirty_table = None
+        merge = self.push_snap(piece_table, (first, old_end, new_end))
+        try:
+            for i in range(len(edits) - 1, -1, -1):
+                pos, removed, text = edits[i]
+                if self.journal:
+                    self.journal.record_edit(pos, removed, text, merge)
+                merge = True
+                self.pending = i
+                self.emit(pos, removed, text)
+        finally:
+            self.pending = 0
+        self.typing = None
+
+    def splice_pieces(self, edits, add_start: int):
+        # 按顺序返回应用 edits（已排序）之后的 piece，插入的文本依次位于 add_buffer 中 add_start 开始处
+        old_pieces = iter(self.cur_piece_table)
+        piece = None
+        offset = 0  # piece 在旧文本中的起点
+        copied = 0  # 旧文本中 [0, copied) 已经处理完
+        for pos, removed, text in edits + [(len(self.cur_piece_table), 0, '')]:
+            # 复制 [copied, pos) 的旧内容
+            while copied < pos:
+                if piece is None or offset + piece.length <= copied:
+                    if piece is not None:
+                        offset += piece.length
+                    piece = next(old_pieces)
+                    continue
+                begin = copied - offset
+                end = min(pos - offset, piece.length)
+                if begin == 0 and end == piece.length:
+                    yield piece
+                else:
+                    yield Piece(piece.buffer, piece.start + begin, end - begin)
+                copied = offset + end
+            if text:
+                yield Piece(ADD, add_start, len(text))
+                add_start += len(text)
+            copied = pos + removed
+
+    def iter_range(self, begin: int, end: int, piece_table=None):
+        # 依次返回 [begin, end] 区间内各 piece 的文本片段，不拼接全文
+        if piece_table is None:
+            piece_table = self.cur_piece_table
+        return piece_table.iter_range(begin, end + 1)
 
     def subsequence(self, begin: int, end: int):
-        s = self.get_sequence()
-        return s[begin: end + 1]
+        begin = max(0, begin)
+        if begin > end:
+            return ''
+        if self.sequence_table is self.cur_piece_table:
+            return self.sequence[begin: end + 1]
+        return ''.join(self.iter_range(begin, end))
+
+    def char_at(self, pos: int):
+        return self.cur_piece_table.char_at(pos)
+
+    def save(self, filename, encoding='utf-8', encoder=None, chunk_size=1 << 16):
+        # 按块写出当前版本，不拼接全文。先写同目录下的临时文件再改名替换，
+        # 中途出错不会留下半个文件，正在 mmap 的原文件也不会被原地改写。
+        # encoder(source, f) 用于写压缩格式，source() 每次返回一个新的文本块迭代器
+        snapshot = self.snapshot()
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        fd, tmpname = tempfile.mkstemp(prefix='.' + basename + '.', suffix='.tmp', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb' if encoder else 'w', encoding=None if encoder else encoding) as f:
+                if encoder:
+                    encoder(lambda: snapshot.chunks(chunk_size), f)
+                else:
+                    for chunk in snapshot.chunks(chunk_size):
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp 创建的文件只有属主可读写，沿用原文件的权限
+            if os.path.exists(filename):
+                os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmpname, 0o666 & ~umask)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+
+    def snapshot(self):
+        # 当前版本的只读视图，之后的修改不影响它，可以交给其他线程读取
+        return Snapshot(self.cur_piece_table, self.cached_sequence())
+
+    def line_count(self):
+        return self.cur_piece_table.line_feeds() + 1
+
+    def line_of(self, pos: int):
+        # pos 所在的行号，从 0 开始
+        pos = max(0, min(pos, len(self)))
+        return self.cur_piece_table.line_feeds_before(pos)
+
+    def pos_of(self, line: int, col: int = 0):
+        # 第 line 行第 col 列的位置，col 超出行尾时取行尾
+        if line <= 0:
+            start = 0
+        elif line >= self.line_count():
+            return len(self)
+        else:
+            start = self.cur_piece_table.find_line_feed(line - 1) + 1
+        return min(start + max(0, col), self.line_end(line))
+
+    def line_end(self, line: int):
+        # 第 line 行行尾（换行符或文末）的位置
+        end = self.cur_piece_table.find_line_feed(max(0, line))
+        return len(self) if end == -1 else end
+
+    def get_line(self, line: int):
+        # 第 line 行的内容，不含换行符
+        if line < 0 or line >= self.line_count():
+            return ''
+        return self.subsequence(self.pos_of(line), self.line_end(line) - 1)
+
+    def compact(self, max_history=None):
+        # 丢弃超出 max_history 的旧版本，把仍被引用的追加内容重写到新的缓冲区，并合并当前版本中相邻的 piece
+        # 返回回收的字符数、合并掉的 piece 数和丢弃的版本数
+        if max_history is None:
+            max_history = self.max_history
+        dropped = 0
+        if max_history is not None and self.snaps > max_history:
+            dropped = self.snaps - max_history
+            self.drop_history(dropped)
+
+        ranges = []
+        seen = set()
+        for piece_table in self.piece_tables:
+            for node in piece_table.nodes():
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                if node.piece.buffer == ADD:
+                    ranges.append((node.piece.start, node.piece.start + node.piece.length))
+        ranges.sort()
+        starts = []
+        new_starts = []
+        ends = []
+        add_buffer = TextBuffer()
+        for start, end in ranges:
+            if ends and start <= ends[-1]:
+                if end > ends[-1]:
+                    add_buffer.append(self.add_buffer[ends[-1]: end])
+                    ends[-1] = end
+                continue
+            starts.append(start)
+            new_starts.append(len(add_buffer))
+            ends.append(end)
+            add_buffer.append(self.add_buffer[start: end])
+
+        def map_piece(piece):
+            if piece.buffer != ADD:
+                return piece
+            i = bisect.bisect_right(starts, piece.start) - 1
+            return Piece(ADD, new_starts[i] + piece.start - starts[i], piece.length)
+
+        reclaimed = len(self.add_buffer) - len(add_buffer)
+        buffers = [self.original_buffer, add_buffer]
+        memo = {}
+        old_table = self.cur_piece_table
+        self.piece_tables = [piece_table.rebuild(buffers, map_piece, memo) for piece_table in self.piece_tables]
+        self.add_buffer = add_buffer
+        self.buffers = buffers
+
+        pieces = []
+        count = 0
+        for piece in self.piece_tables[self.snaps]:
+            count += 1
+            last = pieces[-1] if pieces else None
+            if last and last.buffer == piece.buffer and last.start + last.length == piece.start:
+                pieces[-1] = Piece(last.buffer, last.start, last.length + piece.length)
+            else:
+                pieces.append(piece)
+        if len(pieces) < count:
+            self.piece_tables[self.snaps] = PieceTree.from_pieces(pieces, buffers)
+        self.cur_piece_table = self.piece_tables[self.snaps]
+
+        # 内容没有变化，缓存的全文仍然有效
+        if self.sequence_table is old_table:
+            self.sequence_table = self.cur_piece_table
+        self.dirty = []
+        self.dirty_table = None
+        self.typing = None
+        return {'chars': reclaimed, 'pieces': count - len(pieces), 'versions': dropped}
+
+    def undo_change(self):
+        # undo() 将产生的修改 (位置, 删除长度, 插入文本)，不能撤销时返回 None
+        if self.snaps <= 0:
+            return None
+        begin, old_end, new_end = self.spans[self.snaps]
+        return begin, new_end - begin, ''.join(self.iter_range(begin, old_end - 1, self.piece_tables[self.snaps - 1]))
+
+    def redo_change(self):
+        if len(self.piece_tables) <= self.snaps + 1:
+            return None
+        begin, old_end, new_end = self.spans[self.snaps + 1]
+        return begin, old_end - begin, ''.join(self.iter_range(begin, new_end - 1, self.piece_tables[self.snaps + 1]))
 
     def undo(self):
-        if self.snaps > 0:
+        self.batch_open = False
+        change = self.undo_change()
+        if change:
             self.snaps -= 1
-            self.cur_piece_table = self.piece_tables[self.snaps]
-        return self.get_sequence()
+            self.switch(self.piece_tables[self.snaps], *change)
+            if self.journal:
+                self.journal.record_undo(*change)
 
     def redo(self):
-        if len(self.piece_tables) > self.snaps + 1:
+        self.batch_open = False
+        change = self.redo_change()
+        if change:
             self.snaps += 1
-            self.cur_piece_table = self.piece_tables[self.snaps]
-            return self.get_sequence()
-        else:
-            pass
+            self.switch(self.piece_tables[self.snaps], *change)
+            if self.journal:
+                self.journal.record_redo(*change)
+
+
+class Snapshot(Searchable):
+
+    def __init__(self, piece_table, sequence=None):
+        self.piece_table = piece_table
+        self.sequence = sequence  # 创建时恰好有效的全文缓存
+
+    def __len__(self):
+        return len(self.piece_table)
+
+    def tree(self):
+        return self.piece_table
+
+    def cached_sequence(self):
+        return self.sequence
+
+    def __iter__(self):
+        # 按 piece 依次返回文本片段
+        return self.piece_table.iter_range(0, len(self.piece_table))
+
+    def iter_range(self, begin: int, end: int):
+        return self.piece_table.iter_range(begin, end + 1)
+
+    def chunks(self, chunk_size=1 << 16):
+        # 按顺序返回长度不超过 chunk_size 的文本块
+        return self.piece_table.iter_range(0, len(self.piece_table), chunk_size)
+
+    def subsequence(self, begin: int, end: int):
+        begin = max(0, begin)
+        if begin > end:
+            return ''
+        if self.sequence is not None:
+            return self.sequence[begin: end + 1]
+        return ''.join(self.piece_table.iter_range(begin, end + 1))
+
+    def char_at(self, pos: int):
+        return self.piece_table.char_at(pos)
+
+    def get_sequence(self):
+        if self.sequence is None:
+            self.sequence = ''.join(self)
+        return self.sequence
 
 
 if __name__ == '__main__':
@@ -154,8 +639,8 @@ if __name__ == '__main__':
     pt = PieceTable(text)
     print(pt.get_sequence())
     # print('1,37 subsequence: ', pt.subsequence(1, 37))
-    print('1,1 delete: ', pt.delete(1, 1))
-    print(pt.get_sequence())
+    pt.delete(1, 1)
+    print('1,1 delete: ', pt.get_sequence())
     # print('undo: ', pt.undo())
     # print('redo: ', pt.redo())
     # print(pt.delete(0, 1))
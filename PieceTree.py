@@ -0,0 +1,319 @@
+import gc
+import random
+
+ORIGINAL = 0
+ADD = 1
+
+
+class Piece:
+    __slots__ = ('buffer', 'start', 'length')
+
+    def __init__(self, buffer: int, start: int, length: int):
+        self.buffer = buffer  # ORIGINAL 或 ADD
+        self.start = start
+        self.length = length
+
+    def __repr__(self):
+        return 'Piece(%d, %d, %d)' % (self.buffer, self.start, self.length)
+
+
+class Node:
+    # 节点创建后不再修改，各版本之间共享未改动的子树
+    __slots__ = ('piece', 'line_feeds', 'priority', 'left', 'right', 'size', 'lf', 'count')
+
+    def __init__(self, piece, line_feeds=0, left=None, right=None, priority=None):
+        self.piece = piece
+        self.line_feeds = line_feeds
+        self.priority = random.random() if priority is None else priority
+        self.left = left
+        self.right = right
+        self.size = piece.length  # 子树文本总长度
+        self.lf = line_feeds  # 子树换行符总数
+        self.count = 1  # 子树中 piece 的个数
+        self.update()
+
+    def copy(self, left, right):
+        return Node(self.piece, self.line_feeds, left, right, self.priority)
+
+    def update(self):
+        self.size = self.piece.length
+        self.lf = self.line_feeds
+        self.count = 1
+        if self.left:
+            self.size += self.left.size
+            self.lf += self.left.lf
+            self.count += self.left.count
+        if self.right:
+            self.size += self.right.size
+            self.lf += self.right.lf
+            self.count += self.right.count
+
+
+class PieceTree:
+
+    def __init__(self, buffers, root=None):
+        self.root = root
+        self.buffers = buffers
+
+    def __len__(self):
+        return self.root.size if self.root else 0
+
+    def __iter__(self):
+        stack = []
+        node = self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.piece
+            node = node.right
+
+    def line_feeds(self):
+        return self.root.lf if self.root else 0
+
+    def piece_count(self):
+        return self.root.count if self.root else 0
+
+    def count_line_feeds(self, piece, offset: int = 0, length: int = None):
+        if length is None:
+            length = piece.length - offset
+        start = piece.start + offset
+        return self.buffers[piece.buffer].count_line_feeds(start, start + length)
+
+    def pieces(self):
+        return list(self)
+
+    @classmethod
+    def from_pieces(cls, pieces, buffers):
+        # 按顺序构造笛卡尔树，O(n)。一次创建大量节点时暂停循环垃圾回收，
+        # 否则历史版本中的节点越多，期间触发的全量回收越慢；节点之间没有环，不需要它
+        tree = cls(buffers)
+        stack = []
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for piece in pieces:
+                if piece.length <= 0:
+                    continue
+                node = Node(piece, tree.count_line_feeds(piece))
+                last = None
+                while stack and stack[-1].priority < node.priority:
+                    last = stack.pop()
+                    last.update()
+                node.left = last
+                if stack:
+                    stack[-1].right = node
+                stack.append(node)
+            while stack:
+                tree.root = stack.pop()
+                tree.root.update()
+        finally:
+            if enabled:
+                gc.enable()
+        return tree
+
+    def rebuild(self, buffers, map_piece, memo):
+        # 用 map_piece 重写每个 piece，memo 保证各版本共享的节点只重建一次
+        def visit(node):
+            if node is None:
+                return None
+            new_node = memo.get(id(node))
+            if new_node is None:
+                new_node = Node(map_piece(node.piece), node.line_feeds, visit(node.left), visit(node.right),
+                                node.priority)
+                memo[id(node)] = new_node
+            return new_node
+
+        return PieceTree(buffers, visit(self.root))
+
+    def nodes(self):
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.left:
+                stack.append(node.left)
+            if node.right:
+                stack.append(node.right)
+
+    def find(self, pos: int):
+        node = self.root
+        while node:
+            left_size = node.left.size if node.left else 0
+            if pos < left_size:
+                node = node.left
+            elif pos < left_size + node.piece.length:
+                return node.piece, pos - left_size
+            else:
+                pos -= left_size + node.piece.length
+                node = node.right
+        return None, 0
+
+    def line_feeds_before(self, pos: int):
+        # [0, pos) 内换行符的个数
+        node = self.root
+        count = 0
+        while node:
+            left_size = node.left.size if node.left else 0
+            left_lf = node.left.lf if node.left else 0
+            if pos < left_size:
+                node = node.left
+            elif pos < left_size + node.piece.length:
+                return count + left_lf + self.count_line_feeds(node.piece, 0, pos - left_size)
+            else:
+                pos -= left_size + node.piece.length
+                count += left_lf + node.line_feeds
+                node = node.right
+        return count
+
+    def find_line_feed(self, k: int):
+        # 第 k 个换行符（从 0 开始计）在文本中的位置，不存在时返回 -1
+        node = self.root
+        pos = 0
+        while node:
+            left_size = node.left.size if node.left else 0
+            left_lf = node.left.lf if node.left else 0
+            if k < left_lf:
+                node = node.left
+            elif k < left_lf + node.line_feeds:
+                piece = node.piece
+                offset = self.buffers[piece.buffer].find_line_feed(piece.start, k - left_lf)
+                return pos + left_size + offset - piece.start
+            else:
+                k -= left_lf + node.line_feeds
+                pos += left_size + node.piece.length
+                node = node.right
+        return -1
+
+    def iter_from(self, pos: int):
+        # 从 pos 所在的 piece 开始顺序遍历，返回 (piece, 片内起始偏移)
+        stack = []
+        node = self.root
+        offset = 0
+        while node:
+            left_size = node.left.size if node.left else 0
+            if pos < left_size:
+                stack.append(node)
+                node = node.left
+            elif pos < left_size + node.piece.length:
+                stack.append(node)
+                offset = pos - left_size
+                break
+            else:
+                pos -= left_size + node.piece.length
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.piece, offset
+            offset = 0
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def iter_range(self, begin: int, end: int, chunk_size: int = None):
+        # 依次返回 [begin, end) 区间内各 piece 的文本片段，给出 chunk_size 时长 piece 再切成不超过它的小段
+        begin = max(0, begin)
+        remaining = min(end, len(self)) - begin
+        for piece, offset in self.iter_from(begin):
+            if remaining <= 0:
+                break
+            start = piece.start + offset
+            length = min(piece.length - offset, remaining)
+            buffer = self.buffers[piece.buffer]
+            if chunk_size is None or length <= chunk_size:
+                yield buffer[start: start + length]
+            else:
+                for i in range(start, start + length, chunk_size):
+                    yield buffer[i: min(i + chunk_size, start + length)]
+            remaining -= length
+
+    def iter_chunks(self, begin: int, min_size: int = 1 << 10, max_size: int = 1 << 16):
+        # 从 begin 开始按块返回文本：相邻的小 piece 拼在一起，长 piece 切开；
+        # 块从 min_size 开始逐次加倍到 max_size，只读到需要的距离就停下时不会多读很多
+        size = min_size
+        parts = []
+        length = 0
+        for text in self.iter_range(begin, len(self), max_size):
+            parts.append(text)
+            length += len(text)
+            if length >= size:
+                yield ''.join(parts)
+                parts = []
+                length = 0
+                size = min(size * 2, max_size)
+        if parts:
+            yield ''.join(parts)
+
+    def char_at(self, pos: int):
+        piece, offset = self.find(pos)
+        if piece is None or pos < 0:
+            raise IndexError('PieceTable index out of range')
+        return self.buffers[piece.buffer][piece.start + offset]
+
+    def split_piece(self, node, offset: int):
+        piece = node.piece
+        left_piece = Piece(piece.buffer, piece.start, offset)
+        right_piece = Piece(piece.buffer, piece.start + offset, piece.length - offset)
+        left_lf = self.count_line_feeds(piece, 0, offset)
+        return Node(left_piece, left_lf), Node(right_piece, node.line_feeds - left_lf)
+
+    def split(self, node, pos: int):
+        if node is None or pos <= 0:
+            return None, node
+        if pos >= node.size:
+            return node, None
+        left_size = node.left.size if node.left else 0
+        if pos <= left_size:
+            left, right = self.split(node.left, pos)
+            return left, node.copy(right, node.right)
+        if pos >= left_size + node.piece.length:
+            left, right = self.split(node.right, pos - left_size - node.piece.length)
+            return node.copy(node.left, left), right
+        left_node, right_node = self.split_piece(node, pos - left_size)
+        return self.merge(node.left, left_node), self.merge(right_node, node.right)
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.priority > b.priority:
+            return a.copy(a.left, self.merge(a.right, b))
+        return b.copy(self.merge(a, b.left), b.right)
+
+    def insert(self, pos: int, piece):
+        # 返回插入后的新版本，原版本保持不变
+        if piece.length <= 0:
+            return self
+        pos = max(0, min(pos, len(self)))
+        left, right = self.split(self.root, pos)
+        node = Node(piece, self.count_line_feeds(piece))
+        return PieceTree(self.buffers, self.merge(self.merge(left, node), right))
+
+    def extend(self, pos: int, length: int):
+        # 把结束于 pos 的 piece 向后延长 length，调用方保证缓冲区中紧随其后的就是新内容
+        return PieceTree(self.buffers, self.extend_node(self.root, pos, length))
+
+    def extend_node(self, node, pos: int, length: int):
+        left_size = node.left.size if node.left else 0
+        end = left_size + node.piece.length
+        if pos <= left_size:
+            return node.copy(self.extend_node(node.left, pos, length), node.right)
+        if pos > end:
+            return node.copy(node.left, self.extend_node(node.right, pos - end, length))
+        piece = node.piece
+        new_piece = Piece(piece.buffer, piece.start, piece.length + length)
+        line_feeds = node.line_feeds + self.count_line_feeds(new_piece, piece.length)
+        return Node(new_piece, line_feeds, node.left, node.right, node.priority)
+
+    def delete(self, begin: int, end: int):
+        # 删除 [begin, end) 区间，返回新版本
+        begin = max(0, begin)
+        end = min(end, len(self))
+        if begin >= end:
+            return self
+        left, rest = self.split(self.root, begin)
+        _, right = self.split(rest, end - begin)
+        return PieceTree(self.buffers, self.merge(left, right))
@@ -0,0 +1,121 @@
+import re
+from functools import lru_cache
+
+from BoyerMoore import BoyerMoore
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+
+class SearchPattern:
+    # 查找框中的一个查找条件：普通字符串直接用 BoyerMoore，正则、忽略大小写和全词匹配编译成正则。
+    # 正则中必定出现的一段字面量先用 str.find 定位，再从它之前最长匹配宽度处开始做正则匹配
+
+    def __init__(self, pattern='', regex=False, ignore_case=False, whole_word=False):
+        self.pattern = pattern
+        self.regex = None
+        self.literal = ''  # 每个匹配中都一定出现的字面量，用于预先过滤
+        self.offset = None  # 字面量与匹配开头的固定距离，不固定时为 None
+        self.max_width = None  # 匹配的最大长度，无上限时为 None
+
+        if not regex and not ignore_case and not whole_word:
+            self.bm = BoyerMoore.compile(pattern)
+            return
+        self.bm = None
+        source = pattern if regex else re.escape(pattern)
+        if whole_word:
+            # 与 AhoCorasick 的全词匹配相同：前后都不能是单词字符；开头的全局标志要留在最前面
+            prefix = re.match(r'(\(\?[aiLmsux]+\))*', source).group()
+            source = prefix + r'(?<!\w)(?:' + source[len(prefix):] + r')(?!\w)'
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        self.regex = re.compile(source, flags)  # 正则写错时抛出 re.error
+        if not ignore_case:
+            self.literal, self.offset, self.max_width = self.analyze(source, flags)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def compile(pattern='', regex=False, ignore_case=False, whole_word=False):
+        # 反复查找下一个时同一个条件只编译一次
+        return SearchPattern(pattern, regex, ignore_case, whole_word)
+
+    @classmethod
+    def analyze(cls, source, flags):
+        try:
+            parsed = sre_parse.parse(source, flags)
+        except Exception:
+            return '', None, None
+        if parsed.state.flags & re.IGNORECASE:
+            return '', None, None
+        max_width = parsed.getwidth()[1]
+        runs = []
+        cls.collect_literals(parsed, list(parsed), runs, 0)
+        # 取最长的字面量，一样长时优先取偏移固定的
+        literal, offset = max(runs, key=lambda run: (len(run[0]), run[1] is not None), default=('', None))
+        return literal, offset, max_width if max_width < sre_parse.MAXREPEAT else None
+
+    @classmethod
+    def collect_literals(cls, parsed, items, runs, offset):
+        # 收集一定会出现的连续字面量 (字面量, 偏移)：顶层的、无标志分组内的、至少重复一次的。
+        # offset 为当前位置与匹配开头的固定距离，前面有长度不固定的部分时为 None
+        run = []
+        run_offset = offset
+        for op, arg in items:
+            if op == sre_parse.LITERAL:
+                run.append(chr(arg))
+                if offset is not None:
+                    offset += 1
+                continue
+            runs.append((''.join(run), run_offset))
+            run = []
+            if op == sre_parse.SUBPATTERN and not arg[1] and not arg[2]:
+                cls.collect_literals(parsed, list(arg[3]), runs, offset)
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+                # 字面量可能出现在任意一次重复中，偏移不固定
+                cls.collect_literals(parsed, list(arg[2]), runs, None)
+            if offset is not None:
+                low, high = sre_parse.SubPattern(parsed.state, [(op, arg)]).getwidth()
+                offset = offset + low if low == high else None
+            run_offset = offset
+        runs.append((''.join(run), run_offset))
+
+    def find_all(self, text, begin=0):
+        # 依次返回互不重叠的匹配 (位置, 长度)
+        begin = max(0, begin)
+        if self.bm:
+            m = len(self.pattern)
+            for index in self.bm.find_all(text, begin):
+                yield index, m
+            return
+        pos = begin
+        while pos <= len(text):
+            start = pos
+            if self.literal:
+                index = text.find(self.literal, pos)
+                if index == -1:
+                    return
+                if self.offset is not None:
+                    # 匹配开头与字面量的距离固定，不会早于 index - offset 开始
+                    start = max(pos, index - self.offset)
+                elif self.max_width is not None:
+                    # 匹配包含这处字面量，不会早于 index - max_width 开始
+                    start = max(pos, index - self.max_width)
+            match = self.regex.search(text, start)
+            if match is None:
+                return
+            yield match.start(), match.end() - match.start()
+            pos = match.end() if match.end() > match.start() else match.end() + 1
+
+    def search(self, text, begin=0):
+        # 第一个匹配 (位置, 长度)，没有时返回 (-1, 0)
+        for match in self.find_all(text, begin):
+            return match
+        return -1, 0
+
+
+if __name__ == '__main__':
+    text = 'class Foo: pass\nclass_name = Foo()\n'
+    print(list(SearchPattern('class', whole_word=True).find_all(text)))
+    print(list(SearchPattern(r'Foo\(\)', regex=True).find_all(text)), SearchPattern(r'Foo\(\)', regex=True).literal)
+    print(list(SearchPattern('foo', ignore_case=True).find_all(text)))
@@ -0,0 +1,62 @@
+import bisect
+
+
+class TextBuffer:
+    # 分块存储，追加时只复制最后一块，避免整个缓冲区反复拼接
+    chunk_size = 1 << 16
+
+    def __init__(self, text=''):
+        self.chunks = []
+        self.chunk_offsets = []  # 每块的起始偏移
+        self.length = 0
+        self.line_feeds = []  # 缓冲区内所有换行符的偏移，递增
+        self.append(text)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, _ = item.indices(self.length)
+            if start >= stop:
+                return ''
+            i = bisect.bisect_right(self.chunk_offsets, start) - 1
+            offset = self.chunk_offsets[i]
+            if stop - offset <= len(self.chunks[i]):
+                return self.chunks[i][start - offset: stop - offset]
+            parts = []
+            while start < stop:
+                offset = self.chunk_offsets[i]
+                parts.append(self.chunks[i][start - offset: stop - offset])
+                start = offset + len(self.chunks[i])
+                i += 1
+            return ''.join(parts)
+        if item < 0:
+            item += self.length
+        if not 0 <= item < self.length:
+            raise IndexError('TextBuffer index out of range')
+        i = bisect.bisect_right(self.chunk_offsets, item) - 1
+        return self.chunks[i][item - self.chunk_offsets[i]]
+
+    def append(self, text: str):
+        if not text:
+            return
+        offset = self.length
+        if self.chunks and len(self.chunks[-1]) + len(text) <= self.chunk_size:
+            self.chunks[-1] += text
+        else:
+            self.chunks.append(text)
+            self.chunk_offsets.append(offset)
+        self.length += len(text)
+        i = text.find('\n')
+        while i != -1:
+            self.line_feeds.append(offset + i)
+            i = text.find('\n', i + 1)
+
+    def count_line_feeds(self, start: int, end: int):
+        # [start, end) 内换行符的个数
+        return bisect.bisect_left(self.line_feeds, end) - bisect.bisect_left(self.line_feeds, start)
+
+    def find_line_feed(self, start: int, k: int):
+        # start 之后第 k 个换行符（从 0 开始计）的偏移
+        return self.line_feeds[bisect.bisect_left(self.line_feeds, start) + k]
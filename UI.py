@@ -1,5 +1,6 @@
 # coding:utf-8
 import os
+import re
 import sys
 import time
 
@@ -7,7 +8,11 @@ import qtawesome
 from PyQt5 import QtCore, QtGui, QtWidgets, QtNetwork
 
 import Highlight
+from FileIndex import FileIndex
 from Huffman import Huffman
+from IncrementalSearch import IncrementalSearch
+from Journal import Journal
+from MappedBuffer import MappedBuffer
 from PieceTable import PieceTable
 
 
@@ -73,12 +78,28 @@ class TextEditor(QtWidgets.QPlainTextEdit):
 
     def __init__(self, parent=None):
         super(TextEditor, self).__init__(parent)
-        self.pt = PieceTable(self.toPlainText())
+        self.max_history = 1000
+        self.pt = PieceTable(self.toPlainText(), max_history=self.max_history)
+        self.pt.add_listener(self.apply_change)
+        # 为 True 时正在把一边的修改同步到另一边（PieceTable 与 QTextDocument），不再反向同步回去
+        self.syncing = False
+        # 所有文字修改（输入、粘贴、输入法、拖放、改写选中的文字）都经过 contentsChange 同步到 PieceTable
+        self.document().contentsChange.connect(self.document_changed)
+        self.setUndoRedoEnabled(False)  # 撤销历史由 PieceTable 维护
         self.filename = ''
         self.language = None
 
         self.find_field: QtWidgets.QLineEdit()
         self.replace_field: QtWidgets.QLineEdit()
+        self.match_label: QtWidgets.QLabel()
+        self.any_check: QtWidgets.QCheckBox()  # 查找框中以空格分隔的任意一个词
+        self.regex_check: QtWidgets.QCheckBox()
+        self.case_check: QtWidgets.QCheckBox()
+        self.word_check: QtWidgets.QCheckBox()
+        self.match_selections = []  # 查找全部时高亮的匹配
+        self.incremental = None  # 边输入边查找
+        self.search_begin = 0  # 开始输入查找内容时光标的位置
+        self.match_selected = False
 
         self.server = None
         self.socket = None
@@ -89,6 +110,19 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         self.cursorPositionChanged.connect(self.highlight_current_line)
         # self.setFocusPolicy(QtCore.Qt.StrongFocus)
 
+        # 停止输入一段时间后整理 PieceTable，回收追加缓冲区
+        self.compact_timer = QtCore.QTimer(self)
+        self.compact_timer.setSingleShot(True)
+        self.compact_timer.setInterval(30000)
+        self.compact_timer.timeout.connect(self.compact)
+
+        # 边输入边查找时每轮事件循环只查找一小段，不阻塞输入
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(0)
+        self.search_timer.timeout.connect(self.search_step)
+        self.verticalScrollBar().valueChanged.connect(self.show_visible_matches)
+
     def keyPressEvent1(self, e: QtGui.QKeyEvent) -> None:
         print(e.text(), e.key())
         cursor = self.textCursor()
@@ -130,42 +164,89 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         return t
 
     def keyPressEvent(self, e: QtGui.QKeyEvent) -> None:
-        cursor = self.textCursor()  # 获取当前光标
-        if e.text():
-            if 32 <= ord(e.text()[0]) <= 126:  # 输入普通字符
-                self.pt.insert(cursor.position(), e.text())
-                self.send_cmd('insert %d %s' % (cursor.position(), e.text()))  # 向其他客户端发送当前的操作
-            elif e.key() == QtCore.Qt.Key_Return:  # 输入回车
-                self.pt.insert(cursor.position(), '\n')
-                self.send_cmd('insert %d %s' % (cursor.position(), '\n'))  # 向其他客户端发送当前的操作
-            elif e.key() == QtCore.Qt.Key_Tab:  # 输入制表符
-                self.pt.insert(cursor.position(), '\t')
-                self.send_cmd('insert %d %s' % (cursor.position(), '\t'))  # 向其他客户端发送当前的操作
-            elif e.key() == QtCore.Qt.Key_Backspace or e.text().encode('utf-8') == b'\x08':  # 退格
-                self.pt.delete(cursor.position() - 1, cursor.position() - 1)
-                self.send_cmd('backspace %d' % cursor.position())  # 向其他客户端发送当前的操作
-            elif e.key() == QtCore.Qt.Key_Delete or e.text().encode('utf-8') == b'\x7f':  # 删除后一个字符
-                self.pt.delete(cursor.position(), cursor.position())
-
+        # QPlainTextEdit 在 ShortcutOverride 中接收了撤销、重做的快捷键，菜单的快捷键收不到，
+        # 而它自己的撤销历史已关闭，所以在这里交给 PieceTable
+        if e.matches(QtGui.QKeySequence.Undo):
+            self.undo()
+            return
+        if e.matches(QtGui.QKeySequence.Redo):
+            self.redo()
+            return
+        # 按键造成的修改由 document_changed 同步到 PieceTable 并发送给其他客户端
         return QtWidgets.QPlainTextEdit.keyPressEvent(self, e)
 
     def mouseReleaseEvent(self, e: QtGui.QMouseEvent) -> None:
         cursor = self.textCursor()
         self.send_cmd('select %d' % cursor.blockNumber())
 
+    def apply_change(self, pos: int, removed: int, text: str):
+        # 把 PieceTable 的修改以最小编辑的方式同步到 QTextDocument
+        if self.syncing:
+            return
+        self.syncing = True
+        try:
+            cursor = QtGui.QTextCursor(self.document())
+            cursor.setPosition(pos)
+            cursor.setPosition(pos + removed, QtGui.QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        finally:
+            self.syncing = False
+
+    def document_changed(self, pos: int, removed: int, added: int):
+        # 把 QTextDocument 的修改同步到 PieceTable，使 PieceTable 始终与看到的内容一致
+        if self.syncing:
+            return
+        length = self.document().characterCount() - 1  # 不含文末的段落分隔符
+        # 修改涉及文末时 Qt 报告的长度会把文末的段落分隔符也算进去
+        excess = pos + removed - len(self.pt)
+        if excess > 0:
+            removed -= excess
+            added -= excess
+        if removed < 0 or added < 0 or len(self.pt) - removed + added != length:
+            # 报告的区间与实际不符时比较全文
+            pos, removed, added = 0, len(self.pt), length
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.setPosition(pos)
+        cursor.setPosition(pos + added, QtGui.QTextCursor.KeepAnchor)
+        text = cursor.selectedText().replace('\u2029', '\n').replace('\u2028', '\n')
+        old = self.pt.subsequence(pos, pos + removed - 1)
+        # 语法高亮等只改格式时文本不变；去掉首尾相同的部分，只同步真正改变的文字
+        prefix = len(os.path.commonprefix([old, text]))
+        suffix = len(os.path.commonprefix([old[prefix:][::-1], text[prefix:][::-1]]))
+        pos += prefix
+        old = old[prefix: len(old) - suffix]
+        text = text[prefix: len(text) - suffix]
+        if not old and not text:
+            return
+        self.syncing = True
+        try:
+            if old and text:
+                self.pt.replace(pos, pos + len(old) - 1, text)
+            elif old:
+                self.pt.delete(pos, pos + len(old) - 1)
+            else:
+                self.pt.insert(pos, text)
+        finally:
+            self.syncing = False
+        # 向其他客户端发送当前的操作
+        if not old:
+            self.send_cmd('insert %d %s' % (pos, text))
+        elif len(old) == 1 and not text:
+            self.send_cmd('del %d' % pos)
+        else:
+            self.send_cmd('replace %d %d %s' % (pos, len(old), text))
+        self.compact_timer.start()
+
     def insert(self, text: str, begin: int = 0):
         self.pt.insert(begin, text)
-        self.setPlainText(self.pt.get_sequence())
 
     def undo(self, send=True):
         self.pt.undo()
-        self.setPlainText(self.pt.get_sequence())
         if send:
             self.send_cmd('undo 1')
 
     def redo(self, send=True):
         self.pt.redo()
-        self.setPlainText(self.pt.get_sequence())
         if send:
             self.send_cmd('redo 1')
 
@@ -175,15 +256,31 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         main_layout = QtWidgets.QGridLayout()
         find_label = QtWidgets.QLabel('Find:')
         self.find_field = QtWidgets.QLineEdit()
+        self.find_field.textEdited.connect(self.search_as_you_type)
         find_btn = QtWidgets.QPushButton('Find Next')
         find_btn.clicked.connect(self.find_str)
+        find_all_btn = QtWidgets.QPushButton('Find All')
+        find_all_btn.clicked.connect(self.find_all_str)
+        self.match_label = QtWidgets.QLabel()
+        self.any_check = QtWidgets.QCheckBox('Any word')
+        self.regex_check = QtWidgets.QCheckBox('Regex')
+        self.case_check = QtWidgets.QCheckBox('Match case')
+        self.case_check.setChecked(True)
+        self.word_check = QtWidgets.QCheckBox('Whole word')
         cancel_btn = QtWidgets.QPushButton('Cancel')
         cancel_btn.clicked.connect(find_dialog.reject)
+        find_dialog.finished.connect(self.clear_matches)
         find_dialog.setLayout(main_layout)
         main_layout.addWidget(find_label, 0, 0, 2, 2)
         main_layout.addWidget(self.find_field, 0, 2, 2, 2)
         main_layout.addWidget(find_btn, 0, 4, 2, 2)
-        main_layout.addWidget(cancel_btn, 3, 4, 2, 2)
+        main_layout.addWidget(self.any_check, 3, 0, 2, 2)
+        main_layout.addWidget(self.match_label, 3, 2, 2, 2)
+        main_layout.addWidget(find_all_btn, 3, 4, 2, 2)
+        main_layout.addWidget(self.regex_check, 6, 0, 2, 2)
+        main_layout.addWidget(self.case_check, 6, 2, 2, 1)
+        main_layout.addWidget(self.word_check, 6, 3, 2, 1)
+        main_layout.addWidget(cancel_btn, 6, 4, 2, 2)
         find_dialog.show()
 
     def _replace(self):
@@ -192,16 +289,26 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         main_layout = QtWidgets.QGridLayout()
         find_label = QtWidgets.QLabel('Find:')
         self.find_field = QtWidgets.QLineEdit()
+        self.find_field.textEdited.connect(self.search_as_you_type)
         find_btn = QtWidgets.QPushButton('Find Next')
         find_btn.clicked.connect(self.find_str)
+        find_all_btn = QtWidgets.QPushButton('Find All')
+        find_all_btn.clicked.connect(self.find_all_str)
+        self.match_label = QtWidgets.QLabel()
+        self.any_check = QtWidgets.QCheckBox('Any word')
+        self.regex_check = QtWidgets.QCheckBox('Regex')
+        self.case_check = QtWidgets.QCheckBox('Match case')
+        self.case_check.setChecked(True)
+        self.word_check = QtWidgets.QCheckBox('Whole word')
         replace_label = QtWidgets.QLabel('Replace:')
         self.replace_field = QtWidgets.QLineEdit()
         replace_btn = QtWidgets.QPushButton('Replace')
         replace_btn.clicked.connect(self.replace)
         replace_all_btn = QtWidgets.QPushButton('Replace All')
-        replace_all_btn.clicked.connect(self.replace_all)
+        replace_all_btn.clicked.connect(lambda: self.replace_all())  # clicked 会把 checked=False 传给 send
         cancel_btn = QtWidgets.QPushButton('Cancel')
         cancel_btn.clicked.connect(find_dialog.reject)
+        find_dialog.finished.connect(self.clear_matches)
         find_dialog.setLayout(main_layout)
         main_layout.addWidget(find_label, 0, 0, 2, 2)
         main_layout.addWidget(self.find_field, 0, 2, 2, 2)
@@ -209,46 +316,169 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         main_layout.addWidget(replace_label, 2, 0, 2, 2)
         main_layout.addWidget(self.replace_field, 2, 2, 2, 2)
         main_layout.addWidget(replace_btn, 2, 4, 2, 2)
-        main_layout.addWidget(replace_all_btn, 4, 4, 2, 2)
-        main_layout.addWidget(cancel_btn, 6, 4, 2, 2)
+        main_layout.addWidget(self.any_check, 4, 0, 2, 2)
+        main_layout.addWidget(self.match_label, 4, 2, 2, 2)
+        main_layout.addWidget(find_all_btn, 4, 4, 2, 2)
+        main_layout.addWidget(self.regex_check, 6, 0, 2, 2)
+        main_layout.addWidget(self.case_check, 6, 2, 2, 1)
+        main_layout.addWidget(self.word_check, 6, 3, 2, 1)
+        main_layout.addWidget(replace_all_btn, 6, 4, 2, 2)
+        main_layout.addWidget(cancel_btn, 8, 4, 2, 2)
         find_dialog.show()
 
     def find_str(self, begin=0, send=True):
         if not begin:
             begin = 0
         pattern = self.find_field.text()
-        start = time.clock()
-        index = self.pt.find(pattern, begin)
-        end = time.clock()
-        print(len(self.pt.get_sequence()))
-        print((end - start))
-        self.select_text(index, len(pattern))
+        index = None
+        if pattern and self.incremental and self.incremental.query == pattern and self.plain_search():
+            # 边输入边查找已经扫描过的部分直接取结果
+            index = self.incremental.next_match(begin)
+        if index is None:
+            try:
+                index, length = next(self.search_matches(pattern, begin), (-1, 0))
+            except re.error as e:
+                self.match_label.setText(str(e))
+                return -1, 0
+        else:
+            length = len(pattern) if index != -1 else 0
+        self.select_text(index, length)
         if self.socket and send:
-            self.send_cmd('find %d %d' % (index, len(pattern)))
-        return index, pattern
+            self.send_cmd('find %d %d' % (index, length))
+        return index, length
+
+    def search_matches(self, pattern: str, begin: int = 0, parallel=False):
+        # 按对话框中的选项依次返回匹配 (位置, 长度)；parallel 为 True 时一次找出全部普通匹配
+        if self.any_check.isChecked():
+            # 替换需要互不重叠的匹配，例如查找 "in int" 时 int 中的 in 不再单独算一个
+            matches = self.pt.find_all_any(pattern.split(), begin, self.word_check.isChecked(), overlapping=False)
+            return ((index, len(word)) for index, word in matches)
+        options = {'regex': self.regex_check.isChecked(), 'ignore_case': not self.case_check.isChecked(),
+                   'whole_word': self.word_check.isChecked()}
+        if any(options.values()):
+            return self.pt.search_all(pattern, begin, **options)
+        indexes = self.pt.find_all_parallel(pattern, begin) if parallel else self.pt.find_all(pattern, begin)
+        return ((index, len(pattern)) for index in indexes)
+
+    def find_all_str(self):
+        # 一遍扫描找出所有匹配，全部高亮并显示个数
+        pattern = self.find_field.text()
+        self.match_selections = []
+        if pattern:
+            try:
+                matches = list(self.search_matches(pattern, parallel=True))
+            except re.error as e:
+                self.match_label.setText(str(e))
+                return
+            match_format = QtGui.QTextCharFormat()
+            match_format.setBackground(QtGui.QColor(QtCore.Qt.cyan).lighter(160))
+            for index, length in matches:
+                selection = QtWidgets.QTextEdit.ExtraSelection()
+                selection.format = match_format
+                selection.cursor = QtGui.QTextCursor(self.document())
+                selection.cursor.setPosition(index)
+                selection.cursor.setPosition(index + length, QtGui.QTextCursor.KeepAnchor)
+                self.match_selections.append(selection)
+        self.match_label.setText('%d matches' % len(self.match_selections))
+        self.highlight_current_line()
+
+    def clear_matches(self):
+        self.close_incremental()
+        self.match_selections = []
+        self.highlight_current_line()
+
+    def plain_search(self):
+        # 只有不带任何选项的普通查找才边输入边查找
+        return not (self.any_check.isChecked() or self.regex_check.isChecked()
+                    or not self.case_check.isChecked() or self.word_check.isChecked())
+
+    def search_as_you_type(self, pattern: str):
+        if not self.plain_search():
+            self.close_incremental()
+            return
+        if self.incremental is None or self.incremental.pt is not self.pt:
+            self.close_incremental()
+            self.incremental = IncrementalSearch(self.pt)
+        self.incremental.update(pattern)
+        self.search_begin = self.textCursor().selectionStart()
+        self.match_selected = False
+        self.search_step()
+
+    def search_step(self):
+        # 查找约 10ms 后显示已有的结果，没有完成时留到下一轮事件循环继续
+        if self.incremental is None:
+            return
+        done = self.incremental.step(0.01)
+        pattern = self.incremental.query
+        if not self.match_selected and pattern:
+            index = self.incremental.next_match(self.search_begin)
+            if index is not None:
+                if index != -1:
+                    self.select_text(index, len(pattern))
+                self.match_selected = True
+        count = len(self.incremental.matches) if pattern else 0
+        self.match_label.setText('%d matches%s' % (count, '' if done else '…'))
+        self.show_visible_matches()
+        if not done:
+            self.search_timer.start()
+
+    def show_visible_matches(self):
+        # 只高亮窗口中能看到的匹配
+        if self.incremental is None:
+            return
+        begin = self.firstVisibleBlock().position()
+        corner = QtCore.QPoint(self.viewport().width() - 1, self.viewport().height() - 1)
+        end = self.cursorForPosition(corner).position() + 1
+        length = len(self.incremental.query)
+        match_format = QtGui.QTextCharFormat()
+        match_format.setBackground(QtGui.QColor(QtCore.Qt.cyan).lighter(160))
+        self.match_selections = []
+        for index in self.incremental.matches_in(begin, end):
+            selection = QtWidgets.QTextEdit.ExtraSelection()
+            selection.format = match_format
+            selection.cursor = QtGui.QTextCursor(self.document())
+            selection.cursor.setPosition(index)
+            selection.cursor.setPosition(index + length, QtGui.QTextCursor.KeepAnchor)
+            self.match_selections.append(selection)
+        self.highlight_current_line()
+
+    def close_incremental(self):
+        self.search_timer.stop()
+        if self.incremental:
+            self.incremental.close()
+            self.incremental = None
 
     def replace(self, begin=0, send=True):
         if not begin:
             begin = 0
-        _, pattern = self.find_str(begin, False)
+        index, length = self.find_str(begin, False)
         text = self.replace_field.text()
-        index = self.pt.find(pattern, begin)
         if index == -1:
             self.moveCursor(QtGui.QTextCursor.End)
         else:
-            self.pt.replace(index, index + len(pattern) - 1, text)
-            self.setPlainText(self.pt.get_sequence())
-            self.select_text(index, len(pattern))
+            self.pt.replace(index, index + length - 1, text)
+            self.select_text(index, length)
             if self.socket and send:
-                self.send_cmd('replace %d %d %s' % (index, len(pattern), text))
-        return index, pattern, text
+                self.send_cmd('replace %d %d %s' % (index, length, text))
+        return index, length, text
 
-    def replace_all(self):
-        index, pattern, text = self.replace(0)
-        while index + len(pattern) <= len(self.pt.get_sequence()):
-            index, _, _ = self.replace(index)
-            if index == -1:
-                break
+    def replace_all(self, send=True):
+        pattern = self.find_field.text()
+        text = self.replace_field.text()
+        if not pattern:
+            return
+        try:
+            matches = list(self.search_matches(pattern, parallel=True))
+        except re.error as e:
+            self.match_label.setText(str(e))
+            return
+        cursor = self.textCursor()
+        cursor.beginEditBlock()  # 文档的所有修改合并为一次布局更新
+        self.pt.apply_edits([(index, length, text) for index, length in matches])  # 只产生一个撤销步骤
+        cursor.endEditBlock()
+        if self.socket and send:
+            for index, length in reversed(matches):  # 对方逐条执行，从后往前发送，前面的位置不受影响
+                self.send_cmd('replace %d %d %s' % (index, length, text))
 
     def select_text(self, begin: int, length: int):
         cursor = self.textCursor()
@@ -273,7 +503,7 @@ class TextEditor(QtWidgets.QPlainTextEdit):
             selection.cursor = self.textCursor()
             extra_selections.append(selection)
 
-        self.setExtraSelections(extra_selections)
+        self.setExtraSelections(extra_selections + self.match_selections)
 
     def highlight_line(self, extra_line=False, block_numbers=[]):
         extra_selections = []
@@ -298,14 +528,84 @@ class TextEditor(QtWidgets.QPlainTextEdit):
         self.setExtraSelections(extra_selections)
 
     def get_block_number_by_pos(self, pos):
-        block = self.document().findBlock(pos)
-        cursor = QtGui.QTextCursor(block)
-        print(cursor.blockNumber())
-        return cursor.blockNumber()
+        block_number = self.pt.line_of(pos)
+        print(block_number)
+        return block_number
+
+    def compact(self):
+        self.pt.compact()
+
+    def load(self, content: str, filename: str):
+        # 以文件内容作为原始缓冲区；若有与该文件匹配的撤销日志，则恢复其中未保存的修改和撤销历史
+        self.filename = filename
+        self.close_journal()
+        self.close_incremental()
+        journal = Journal(Journal.path_of(filename))
+        try:
+            if journal.matches(filename) and not journal.empty() and self.ask_restore(filename):
+                self.pt = journal.restore(content, max_history=self.max_history)
+            else:
+                self.pt = PieceTable(content, max_history=self.max_history)
+                journal.start(filename)
+                self.pt.journal = journal
+        except OSError:
+            self.pt = PieceTable(content, max_history=self.max_history)
+        self.pt.add_listener(self.apply_change)
+        self.show_sequence()
+
+    def ask_restore(self, filename: str):
+        # 不恢复时日志会从文件当前的内容重新开始，其中的修改随之丢弃
+        ret = QtWidgets.QMessageBox.question(self, 'Restore Changes?',
+                                             '%s has unsaved changes from a previous session. Restore them?'
+                                             % os.path.basename(filename),
+                                             QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+        return ret == QtWidgets.QMessageBox.Yes
+
+    def show_sequence(self):
+        # 用 PieceTable 的全文重新填充文档，这次修改不需要再同步回 PieceTable
+        self.syncing = True
+        try:
+            self.setPlainText(self.pt.get_sequence())
+        finally:
+            self.syncing = False
+
+    def save(self, filename: str):
+        # 从 PieceTable 逐块写出，不经过 toPlainText()；.ac 文件边编码边写
+        if filename.rsplit('.', maxsplit=1)[-1] == 'ac':
+            self.pt.save(filename, encoder=Huffman().encode_chunks)
+        else:
+            self.pt.save(filename)
+        self.saved(filename)
+
+    def saved(self, filename: str):
+        # 文件已写入磁盘，撤销日志从新的文件内容重新开始
+        self.filename = filename
+        self.close_journal()
+        journal = Journal(Journal.path_of(filename))
+        try:
+            journal.start(filename)
+            self.pt.journal = journal
+        except OSError:
+            pass
+
+    def close_journal(self):
+        # 保留日志文件，下次打开时可以恢复（例如直接退出程序时）
+        if self.pt.journal:
+            self.pt.journal.close()
+            self.pt.journal = None
+
+    def discard_journal(self):
+        # 关闭文档且不保存时删除日志
+        if self.pt.journal:
+            self.pt.journal.discard()
+            self.pt.journal = None
 
     def reset(self):
-        self.pt = PieceTable()
-        self.setPlainText(self.pt.get_sequence())
+        self.discard_journal()
+        self.close_incremental()
+        self.pt = PieceTable(max_history=self.max_history)
+        self.pt.add_listener(self.apply_change)
+        self.show_sequence()
 
     def init_tcp(self, is_server, addr):
         if is_server:
@@ -323,8 +623,9 @@ class TextEditor(QtWidgets.QPlainTextEdit):
             return
         self.socket = self.server.nextPendingConnection()
         self.socket.readyRead.connect(self.recv)
-        init_data = 'init ' + self.filename + ' ' + self.pt.get_sequence()
-        self.send_cmd(init_data)
+        self.send_cmd('init ' + self.filename + ' ')
+        for chunk in self.pt.iter_range(0, len(self.pt) - 1):  # 按 piece 分段发送，不拼接全文
+            self.socket.write(chunk.encode('utf-8'))
 
     def close_connection(self):
         if self.socket:
@@ -354,21 +655,15 @@ class TextEditor(QtWidgets.QPlainTextEdit):
             self.highlight_line(extra_line=True, block_numbers=[block_number + 1])
         elif command == 'backspace':
             print(data_list)
-            old_cursor = self.textCursor()
             pos = int(data_list[0])
             self.pt.delete(pos - 1, pos - 1)
-            self.setPlainText(self.pt.get_sequence())
-            self.setTextCursor(old_cursor)
             block_number = self.get_block_number_by_pos(pos)
             if block_number < self.blockCount():
                 self.highlight_line(extra_line=True, block_numbers=[block_number])
         elif command == 'del':
             print(data_list)
-            old_cursor = self.textCursor()
             pos = int(data_list[0])
             self.pt.delete(pos, pos)
-            self.setPlainText(self.pt.get_sequence())
-            self.setTextCursor(old_cursor)
             block_number = self.get_block_number_by_pos(pos)
             if block_number < self.blockCount():
                 self.highlight_line(extra_line=True, block_numbers=[block_number])
@@ -391,7 +686,6 @@ class TextEditor(QtWidgets.QPlainTextEdit):
             len_pattern, text = data_list[1].split(sep=' ', maxsplit=1)
             len_pattern = int(len_pattern)
             self.pt.replace(pos, pos + len_pattern - 1, text)
-            self.setPlainText(self.pt.get_sequence())
             self.select_text(pos, len_pattern)
         elif command == 'init':
             # if self.filename == '':
@@ -434,6 +728,19 @@ class AlphaCoder(QtWidgets.QMainWindow):
         self.highlighters = []
         self.cur_tab = -1
 
+        self.folder = ''  # 打开的文件夹
+        self.file_index = None  # 文件夹的三元组索引，用于在所有文件中查找
+        self.file_tree = None
+        self.index_work = None  # 尚未完成的索引更新
+        self.file_results = None  # 尚未取完的查找结果
+        # 索引和查找都在事件循环中分段执行，每次约 10ms，不阻塞界面
+        self.index_timer = QtCore.QTimer(self)
+        self.index_timer.setInterval(0)
+        self.index_timer.timeout.connect(self.index_step)
+        self.results_timer = QtCore.QTimer(self)
+        self.results_timer.setInterval(0)
+        self.results_timer.timeout.connect(self.results_step)
+
         self.status = self.statusBar()
         self.status.setSizeGripEnabled(False)
         self.status.showMessage('Ready', 5000)
@@ -480,6 +787,9 @@ class AlphaCoder(QtWidgets.QMainWindow):
         self.action_replace = self.menu_edit.addAction('Replace')
         self.action_replace.setShortcut('Ctrl+R')
         self.action_replace.triggered.connect(self.replace)
+        self.action_find_in_files = self.menu_edit.addAction('Find in Files')
+        self.action_find_in_files.setShortcut('Ctrl+Shift+F')
+        self.action_find_in_files.triggered.connect(self.find_in_files)
         self.menu_edit.addSeparator()
         self.action_copy = self.menu_edit.addAction('Copy')
         self.action_copy.setShortcut('Ctrl+C')
@@ -629,6 +939,8 @@ class AlphaCoder(QtWidgets.QMainWindow):
         text_editor = self.text_editors[index]
         text_editor.send_cmd('exit')
         text_editor.close_connection()
+        text_editor.discard_journal()
+        text_editor.close_incremental()
         self.rightTabWidget.removeTab(index)
         self.text_editors.pop(index)
         self.line_number_areas.pop(index)
@@ -682,34 +994,136 @@ class AlphaCoder(QtWidgets.QMainWindow):
             self, 'Choose File', dir,
             'ALL(*.*);;Python file(*.py *.pyw);;C/C++ file(*.c *.cpp *.h);;Java file(*.java)')[0])
         if fname:
-            fsize = os.path.getsize(fname)
-            # print(fsize)
-            if fsize > 1e6:
-                self.filenames[self.cur_tab] = fname
-                self.open_lines_dialog()
-                return
-            if fname.rsplit('.', maxsplit=1)[-1] == 'ac':
-                content = Huffman().decode(fname)
-            else:
-                try:
-                    with open(fname, 'r', encoding='UTF-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    with open(fname, 'r', encoding='GBK') as f:
-                        content = f.read()
-            self.new_tab()
+            self.open_path(fname)
+
+    def find_tab(self, fname: str):
+        # 已经打开 fname 的标签页下标，没有时返回 -1
+        path = os.path.normcase(os.path.abspath(fname))
+        for i, filename in enumerate(self.filenames):
+            if filename != 'untitled' and os.path.normcase(os.path.abspath(filename)) == path:
+                return i
+        return -1
+
+    def open_path(self, fname: str):
+        # 打开文件，返回其所在标签页的编辑器；文件太大、先询问打开哪些行时返回 None。
+        # 已经打开的文件只切换到原来的标签页：同一文件的两个编辑器会共用并互相破坏撤销日志
+        index = self.find_tab(fname)
+        if index != -1:
+            self.rightTabWidget.setCurrentIndex(index)
+            self.cur_tab = index
+            return self.text_editors[index]
+        fsize = os.path.getsize(fname)
+        # print(fsize)
+        if fsize > 1e6:
             self.filenames[self.cur_tab] = fname
-            self.rightTabWidget.setTabText(self.rightTabWidget.currentIndex(), fname)
-            self.languages[self.cur_tab] = fname.rsplit('.', maxsplit=1)[-1]
-            if self.languages[self.cur_tab] == 'c':
-                self.languages[self.cur_tab] = 'cpp'
-            self.highlighters[self.cur_tab].set_language(self.languages[self.cur_tab])
-            # self.text_editors[self.cur_tab].setPlainText(content)
-            self.text_editors[self.cur_tab].insert(content)
-            self.text_editors[self.cur_tab].filename = fname
+            self.open_lines_dialog()
+            return None
+        if fname.rsplit('.', maxsplit=1)[-1] == 'ac':
+            content = Huffman().decode(fname)
+        else:
+            try:
+                with open(fname, 'r', encoding='UTF-8') as f:
+                    content = f.read()
+            except UnicodeDecodeError:
+                with open(fname, 'r', encoding='GBK') as f:
+                    content = f.read()
+        self.new_tab()
+        self.filenames[self.cur_tab] = fname
+        self.rightTabWidget.setTabText(self.rightTabWidget.currentIndex(), fname)
+        self.languages[self.cur_tab] = fname.rsplit('.', maxsplit=1)[-1]
+        if self.languages[self.cur_tab] == 'c':
+            self.languages[self.cur_tab] = 'cpp'
+        self.highlighters[self.cur_tab].set_language(self.languages[self.cur_tab])
+        # self.text_editors[self.cur_tab].setPlainText(content)
+        self.text_editors[self.cur_tab].load(content, fname)
+        return self.text_editors[self.cur_tab]
 
     def open_folder(self):
-        pass
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Choose Folder', os.path.abspath('.'))
+        if not folder:
+            return
+        self.close_folder()
+        self.folder = folder
+        # 读入上次保存的索引，再在后台检查改动过的文件
+        self.file_index = FileIndex(folder)
+        self.index_work = self.file_index.scan()
+        self.index_timer.start()
+        self.open_file_tree()
+
+    def close_folder(self):
+        self.index_timer.stop()
+        self.results_timer.stop()
+        self.index_work = None
+        self.file_results = None
+        if self.file_index:
+            # 查找已经停止，可以重新编号
+            self.file_index.save(compact=True)
+            self.file_index = None
+
+    def index_step(self):
+        deadline = time.perf_counter() + 0.01
+        for _ in self.index_work:
+            if time.perf_counter() >= deadline:
+                self.status.showMessage('Indexing... %d files' % len(self.file_index))
+                return
+        self.index_timer.stop()
+        self.index_work = None
+        self.file_index.save()
+        self.status.showMessage('Indexed %d files' % len(self.file_index), 5000)
+
+    def find_in_files(self):
+        if not self.file_index:
+            self.open_folder()
+            if not self.file_index:
+                return
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle('Find in Files')
+        dialog.resize(600, 400)
+        main_layout = QtWidgets.QGridLayout()
+        find_label = QtWidgets.QLabel('Find:')
+        self.files_field = QtWidgets.QLineEdit()
+        self.files_field.returnPressed.connect(self.search_files)
+        find_btn = QtWidgets.QPushButton('Find')
+        find_btn.clicked.connect(self.search_files)
+        self.files_label = QtWidgets.QLabel()
+        self.files_list = QtWidgets.QListWidget()
+        self.files_list.itemDoubleClicked.connect(self.open_result)
+        dialog.finished.connect(self.results_timer.stop)
+        dialog.setLayout(main_layout)
+        main_layout.addWidget(find_label, 0, 0, 1, 1)
+        main_layout.addWidget(self.files_field, 0, 1, 1, 2)
+        main_layout.addWidget(find_btn, 0, 3, 1, 1)
+        main_layout.addWidget(self.files_label, 1, 0, 1, 4)
+        main_layout.addWidget(self.files_list, 2, 0, 1, 4)
+        dialog.show()
+
+    def search_files(self):
+        self.files_list.clear()
+        self.files_pattern = self.files_field.text()
+        self.file_results = self.file_index.search(self.files_pattern)
+        self.results_timer.start()
+
+    def results_step(self):
+        # 查找结果边找到边显示
+        deadline = time.perf_counter() + 0.01
+        for path, line, column, text in self.file_results:
+            item = QtWidgets.QListWidgetItem('%s:%d: %s' % (os.path.relpath(path, self.folder), line + 1,
+                                                              text.strip()))
+            item.setData(QtCore.Qt.UserRole, (path, line, column))
+            self.files_list.addItem(item)
+            if time.perf_counter() >= deadline:
+                self.files_label.setText('%d matches...' % self.files_list.count())
+                return
+        self.results_timer.stop()
+        self.file_results = None
+        self.files_label.setText('%d matches' % self.files_list.count())
+
+    def open_result(self, item: QtWidgets.QListWidgetItem):
+        # 按行列号定位：打开文件时换行符已统一为 \n，文件中的字符位置与编辑器中的不一定相同
+        path, line, column = item.data(QtCore.Qt.UserRole)
+        text_editor = self.open_path(path)
+        if text_editor:
+            text_editor.select_text(text_editor.pt.pos_of(line, column), len(self.files_pattern))
 
     def save_file(self):
         self.cur_tab = self.rightTabWidget.currentIndex()
@@ -717,12 +1131,16 @@ class AlphaCoder(QtWidgets.QMainWindow):
             if self.filenames[self.cur_tab] == 'untitled':
                 self.save_file_as()
             else:
-                content = self.text_editors[self.cur_tab].toPlainText()
-                with open(self.filenames[self.cur_tab], 'w') as f:
-                    f.write(content)
+                self.text_editors[self.cur_tab].save(self.filenames[self.cur_tab])
+                self.update_index(self.filenames[self.cur_tab])
         else:
             self.save_file_as()
 
+    def update_index(self, fname: str):
+        # 保存的文件在打开的文件夹中时只重新索引这一个文件，索引在关闭文件夹时写回磁盘
+        if self.file_index:
+            self.file_index.update_file(fname)
+
     def save_file_as(self):
         dir = os.path.dirname('.')
         fname = str(QtWidgets.QFileDialog.getSaveFileName(
@@ -734,16 +1152,8 @@ class AlphaCoder(QtWidgets.QMainWindow):
             self.rightTabWidget.setTabText(self.rightTabWidget.currentIndex(), fname)
             self.languages[self.cur_tab] = fname.rsplit('.', maxsplit=1)[-1]
             self.highlighters[self.cur_tab].set_language(self.languages[self.cur_tab])
-            content = self.text_editors[self.cur_tab].toPlainText()
-            if fname.rsplit('.', maxsplit=1)[-1] == 'ac':
-                tmpname = fname.rsplit('.', maxsplit=1)[0] + '.tmp'
-                with open(tmpname, 'w') as f:
-                    f.write(content)
-                Huffman().encode(tmpname)
-                os.remove(tmpname)
-            else:
-                with open(fname, 'w') as f:
-                    f.write(content)
+            self.text_editors[self.cur_tab].save(fname)
+            self.update_index(fname)
 
     def open_preference(self):
         pass
@@ -828,7 +1238,32 @@ class AlphaCoder(QtWidgets.QMainWindow):
             self.rightTabWidget.setTabText(self.rightTabWidget.currentIndex(), 'Output')
 
     def open_file_tree(self):
-        print('open file tree')
+        if not self.folder:
+            self.open_folder()
+            return
+        if self.file_tree is None:
+            self.file_tree = QtWidgets.QDockWidget('Files', self)
+            model = QtWidgets.QFileSystemModel(self.file_tree)
+            view = QtWidgets.QTreeView()
+            view.setModel(model)
+            for column in range(1, model.columnCount()):
+                view.hideColumn(column)
+            view.doubleClicked.connect(self.open_tree_item)
+            self.file_tree.setWidget(view)
+            self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.file_tree)
+        view = self.file_tree.widget()
+        view.model().setRootPath(self.folder)
+        view.setRootIndex(view.model().index(self.folder))
+        self.file_tree.show()
+
+    def open_tree_item(self, index: QtCore.QModelIndex):
+        path = self.file_tree.widget().model().filePath(index)
+        if os.path.isfile(path):
+            self.open_path(path)
+
+    def closeEvent(self, e: QtGui.QCloseEvent) -> None:
+        self.close_folder()
+        super().closeEvent(e)
 
     def open_lines_dialog(self):
         dialog = QtWidgets.QDialog(self)
@@ -877,8 +1312,7 @@ class AlphaCoder(QtWidgets.QMainWindow):
             self.languages[self.cur_tab] = 'cpp'
         self.highlighters[self.cur_tab].set_language(self.languages[self.cur_tab])
         # self.text_editors[self.cur_tab].setPlainText(content)
-        self.text_editors[self.cur_tab].insert(content)
-        self.text_editors[self.cur_tab].filename = fname
+        self.text_editors[self.cur_tab].load(content, fname)
 
     def open_lines(self):
         fname = self.filenames[self.cur_tab]
@@ -886,15 +1320,16 @@ class AlphaCoder(QtWidgets.QMainWindow):
             content = Huffman().decode(fname)
         else:
             try:
-                with open(fname, 'r', encoding='UTF-8') as f:
-                    i = 1
-                    content = ''
-                    while i < int(self.from_lines.text()):
-                        i += 1
-                        f.readline()
-                    while i <= int(self.to_lines.text()):
-                        i += 1
-                        content += f.readline()
+                # 用 mmap 映射文件，只索引、解码到所需的最后一行为止
+                buffer = MappedBuffer(fname)
+                try:
+                    content = buffer[buffer.line_start(int(self.from_lines.text()) - 1):
+                                     buffer.line_start(int(self.to_lines.text()))]
+                finally:
+                    buffer.close()
+                # mmap 读出的是原始文本，与文本模式读取一样把 \r\n 和 \r 换成 \n，
+                # 否则 QTextDocument 把 \r\n 合成一个换行后位置与 PieceTable 对不上
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
             except UnicodeDecodeError:
                 with open(fname, 'r', encoding='GBK') as f:
                     i = 1
@@ -1,3 +1,6 @@
-import UI
+# ParallelSearch 的子进程用 spawn 启动时会以 __mp_main__ 的名字重新执行本文件，
+# 只有直接运行时才导入 Qt 并打开编辑器窗口
+if __name__ == '__main__':
+    import UI
 
-UI.run()
+    UI.run()
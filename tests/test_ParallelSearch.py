@@ -0,0 +1,70 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MappedBuffer import MappedBuffer
+from ParallelSearch import ParallelSearch
+from PieceTable import PieceTable
+
+PATTERNS = ['ab', 'aba', 'aaab', 'a中b', '中\n', 'b\nb中a']
+
+
+class ParallelSearchTest(unittest.TestCase):
+    # 子进程用 spawn 启动，会重新导入本模块，所以直接运行时 unittest.main() 要放在 __main__ 判断里
+
+    def setUp(self):
+        self.search = ParallelSearch(workers=2)
+        self.search.min_size = 0  # 再短的文本也交给子进程，块很小以便产生大量跨块匹配
+        self.search.chunk_size = 97
+        self.rng = random.Random(0)
+
+    def tearDown(self):
+        self.search.close()
+
+    def random_text(self, length):
+        return ''.join(self.rng.choice('ab中\n') for _ in range(length))
+
+    def check(self, piece_table):
+        for pattern in PATTERNS:
+            for begin in (0, 1, self.rng.randrange(len(piece_table)), len(piece_table) - 2):
+                for overlapping in (False, True):
+                    self.assertEqual(self.search.find_all(piece_table, pattern, begin, overlapping),
+                                     ParallelSearch.find_all_serial(piece_table, pattern, begin, overlapping),
+                                     (pattern, begin, overlapping))
+        self.assertIsNotNone(self.search.executor)  # 子进程出错时会关闭进程池退回串行查找
+
+    def test_edited_table(self):
+        pt = PieceTable(self.random_text(3000), coalesce_interval=-1)
+        for _ in range(60):
+            pos = self.rng.randrange(len(pt))
+            if self.rng.random() < 0.3:
+                pt.delete(pos, min(len(pt), pos + self.rng.randrange(1, 5)))
+            else:
+                pt.insert(pos, self.rng.choice(['ab', 'aab', '中\n', 'b\nb']))
+        self.assertIsNone(self.search.mapped_tasks(pt.cur_piece_table, 'ab', 0))
+        self.check(pt.cur_piece_table)
+
+    def test_mapped_file(self):
+        block_size = MappedBuffer.block_size
+        MappedBuffer.block_size = 64  # 按字节分块，多字节字符会落在块的边界上
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                fname = os.path.join(folder, 'mapped.txt')
+                with open(fname, 'w', encoding='utf-8', newline='') as f:
+                    f.write(self.random_text(5000))
+                pt = PieceTable.from_file(fname)
+                try:
+                    self.assertIsNotNone(self.search.mapped_tasks(pt.cur_piece_table, 'ab', 0))
+                    self.check(pt.cur_piece_table)
+                finally:
+                    pt.close()
+        finally:
+            MappedBuffer.block_size = block_size
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from IncrementalSearch import IncrementalSearch
+from Journal import Journal
+from PieceTable import PieceTable
+
+WORDS = ['a', 'b', 'c', ' ', '\n', 'ab', 'abc', 'piece', '中文', 'x\ny', '\n\n']
+
+
+class RandomEdits:
+    # 对 PieceTable 和一个普通 str 做同样的随机修改，states[i] 为第 i 个历史版本的内容
+
+    def __init__(self, seed, text='', **kwargs):
+        self.rng = random.Random(seed)
+        self.model = text
+        self.pt = PieceTable(text, **kwargs)
+        self.states = [text]
+        self.table = self.pt.cur_piece_table
+
+    def edit(self):
+        rng = self.rng
+        model = self.model
+        op = rng.randrange(8)
+        if op <= 1 or not model:
+            # 逐个字符输入，触发连续输入的合并
+            pos = rng.randrange(len(model) + 1)
+            for ch in rng.choice(WORDS):
+                self.pt.insert(pos, ch)
+                model = model[:pos] + ch + model[pos:]
+                self.record(model)
+                pos += 1
+        elif op == 2:
+            pos = rng.randrange(len(model) + 1)
+            text = rng.choice(WORDS) * rng.randrange(1, 4)
+            self.pt.insert(pos, text)
+            model = model[:pos] + text + model[pos:]
+        elif op == 3:
+            begin = rng.randrange(len(model))
+            end = min(len(model) - 1, begin + rng.randrange(8))
+            self.pt.delete(begin, end)
+            model = model[:begin] + model[end + 1:]
+        elif op == 4:
+            begin = rng.randrange(len(model))
+            end = min(len(model) - 1, begin + rng.randrange(8))
+            text = rng.choice(WORDS)
+            self.pt.replace(begin, end, text)
+            model = model[:begin] + text + model[end + 1:]
+        elif op == 5:
+            begin = rng.randrange(len(model))
+            end = min(len(model) - 1, begin + rng.randrange(8))
+            moved = model[begin: end + 1]
+            rest = model[:begin] + model[end + 1:]
+            to = rng.randrange(len(rest) + 1)
+            self.pt.move(begin, end, to)
+            model = rest[:to] + moved + rest[to:]
+        elif op == 6:
+            edits = self.random_edits(model)
+            self.pt.apply_edits(edits)
+            for pos, removed, text in reversed(sorted(edits, key=lambda edit: (edit[0], edit[1] > 0))):
+                model = model[:pos] + text + model[pos + removed:]
+        else:
+            with self.pt.transaction():
+                for _ in range(rng.randrange(1, 4)):
+                    pos = rng.randrange(len(model) + 1)
+                    text = rng.choice(WORDS)
+                    self.pt.insert(pos, text)
+                    model = model[:pos] + text + model[pos:]
+        self.record(model)
+
+    def record(self, model):
+        # 每次修改后调用：合并进上一步时替换当前版本，否则在当前版本之后追加；没有产生修改时保留重做历史
+        self.model = model
+        if self.pt.cur_piece_table is self.table:
+            return
+        self.table = self.pt.cur_piece_table
+        del self.states[self.pt.snaps:]
+        self.states.append(model)
+
+    def random_edits(self, model):
+        edits = []
+        pos = 0
+        while pos <= len(model) and len(edits) < 6:
+            pos += self.rng.randrange(0, 6)
+            if pos > len(model):
+                break
+            removed = self.rng.randrange(0, min(4, len(model) - pos) + 1)
+            edits.append((pos, removed, self.rng.choice(WORDS + [''])))
+            pos += removed
+        self.rng.shuffle(edits)
+        return edits
+
+    def undo(self):
+        self.pt.undo()
+        self.model = self.states[self.pt.snaps]
+        self.table = self.pt.cur_piece_table
+
+    def redo(self):
+        self.pt.redo()
+        self.model = self.states[self.pt.snaps]
+        self.table = self.pt.cur_piece_table
+
+    def step(self):
+        r = self.rng.random()
+        if r < 0.15:
+            self.undo()
+        elif r < 0.22:
+            self.redo()
+        elif r < 0.25:
+            self.pt.compact()
+            self.table = self.pt.cur_piece_table
+        else:
+            self.edit()
+
+
+class PieceTableTest(unittest.TestCase):
+
+    def check(self, pt, model):
+        self.assertEqual(len(pt), len(model))
+        self.assertEqual(pt.get_sequence(), model)
+        self.assertEqual(''.join(pt.iter_range(0, len(model) - 1)), model)
+        self.assertEqual(pt.line_count(), model.count('\n') + 1)
+
+    def check_reads(self, pt, model, rng):
+        for _ in range(5):
+            begin = rng.randrange(len(model) + 1)
+            end = rng.randrange(begin - 1, len(model) + 1)
+            self.assertEqual(pt.subsequence(begin, end), model[begin: end + 1])
+            pos = rng.randrange(len(model) + 1)
+            line = model.count('\n', 0, pos)
+            self.assertEqual(pt.line_of(pos), line)
+            start = model.rfind('\n', 0, pos) + 1
+            self.assertEqual(pt.pos_of(line, pos - start), pos)
+            self.assertEqual(pt.get_line(line), model.split('\n')[line])
+        for pattern in ('a', 'ab', '\n', '中文'):
+            expected = []
+            index = model.find(pattern)
+            while index != -1:
+                expected.append(index)
+                index = model.find(pattern, index + len(pattern))
+            self.assertEqual(list(pt.find_all(pattern)), expected)
+
+    def test_random_against_str(self):
+        for seed in range(200):
+            edits = RandomEdits(seed, 'hello\nworld')
+            for _ in range(60):
+                edits.step()
+                self.check(edits.pt, edits.model)
+            self.check_reads(edits.pt, edits.model, edits.rng)
+            # 全部撤销再全部重做
+            while edits.pt.snaps:
+                edits.undo()
+                self.check(edits.pt, edits.model)
+            self.assertEqual(edits.model, 'hello\nworld')
+            while edits.pt.snaps + 1 < len(edits.pt.piece_tables):
+                edits.redo()
+                self.check(edits.pt, edits.model)
+
+    def test_snapshot_is_isolated(self):
+        edits = RandomEdits(1, 'snapshot')
+        for _ in range(20):
+            edits.edit()
+        snapshot = edits.pt.snapshot()
+        text = edits.model
+        for _ in range(20):
+            edits.edit()
+        self.assertEqual(snapshot.get_sequence(), text)
+        self.assertEqual(''.join(snapshot.chunks(3)), text)
+
+    def test_compact_keeps_content_and_history(self):
+        edits = RandomEdits(2)
+        for _ in range(80):
+            edits.edit()
+        edits.pt.compact()
+        self.check(edits.pt, edits.model)
+        while edits.pt.snaps:
+            edits.undo()
+            self.check(edits.pt, edits.model)
+
+    def test_max_history(self):
+        pt = PieceTable('', max_history=3)
+        for i in range(10):
+            pt.insert(len(pt), '%d ' % i, merge=False)
+        self.assertEqual(pt.snaps, 3)
+        for _ in range(5):
+            pt.undo()
+        self.assertEqual(pt.get_sequence(), '0 1 2 3 4 5 6 ')
+
+    def test_no_history(self):
+        pt = PieceTable('', max_history=0)
+        pt.insert(0, 'a')
+        pt.insert(1, 'b')
+        with pt.transaction():
+            pt.insert(2, 'c')
+            pt.insert(3, 'd')
+        pt.compact()
+        pt.insert(4, 'e')
+        pt.undo()
+        self.assertEqual(pt.get_sequence(), 'abcde')
+        self.assertEqual(pt.snaps, 0)
+        with self.assertRaises(ValueError):
+            PieceTable('', max_history=-1)
+
+    def test_apply_edits_listeners(self):
+        # 逐处路径复制和一次重建两种做法下，监听者都逐处收到修改，增量查找的结果与重新查找一致
+        for seed in range(100):
+            edits = RandomEdits(seed, 'abab aab\nba ' * 8)
+            edits.pt.splice_cost = 0 if seed % 2 else 10 ** 9
+            mirror = [edits.model]
+
+            def listener(pos, removed, inserted):
+                mirror[0] = mirror[0][:pos] + inserted + mirror[0][pos + removed:]
+
+            edits.pt.add_listener(listener)
+            search = IncrementalSearch(edits.pt)
+            search.update('ab')
+            for _ in range(10):
+                if edits.rng.random() < 0.5:
+                    # 全文缓存有效和无效两种情况都要覆盖
+                    edits.pt.get_sequence()
+                edits.pt.apply_edits(edits.random_edits(mirror[0]))
+                while not search.step():
+                    pass
+                text = ''.join(edits.pt.iter_range(0, len(edits.pt) - 1))
+                self.assertEqual(mirror[0], text)
+                self.assertEqual(edits.pt.get_sequence(), text)
+                self.assertEqual(search.matches, [i for i in range(len(text)) if text.startswith('ab', i)])
+
+    def test_patch_sequence(self):
+        # 一次拼接打上多个补丁，与逐个打补丁的结果相同
+        rng = random.Random(5)
+        for _ in range(2000):
+            text = model = ''.join(rng.choice('ab\n') for _ in range(rng.randrange(30)))
+            patches = []
+            for _ in range(rng.randrange(9)):
+                pos = rng.randrange(len(model) + 1)
+                removed = rng.randrange(len(model) - pos + 1)
+                inserted = rng.choice(WORDS + [''])
+                patches.append((pos, removed, inserted))
+                model = model[:pos] + inserted + model[pos + removed:]
+            self.assertEqual(PieceTable.patch_sequence(text, patches), model)
+
+    def test_apply_edits_shares_nodes(self):
+        # 少量修改只复制 O(log n) 个节点，其余节点与上一个版本共享
+        rng = random.Random(3)
+        pt = PieceTable('0123456789' * 500)
+        for _ in range(2000):
+            pt.insert(rng.randrange(len(pt)), 'ab', merge=False)
+        model = pt.get_sequence()
+        old = pt.cur_piece_table
+        old_nodes = {id(node) for node in old.nodes()}
+        pt.apply_edits([(10, 2, 'x'), (5000, 0, 'y'), (8000, 1, '')])
+        new_nodes = [node for node in pt.cur_piece_table.nodes() if id(node) not in old_nodes]
+        self.assertLess(len(new_nodes), 200)
+        self.assertGreater(old.piece_count(), 3000)
+        self.check(pt, model[:10] + 'x' + model[12:5000] + 'y' + model[5000:8000] + model[8001:])
+        pt.undo()
+        self.check(pt, model)
+
+    def test_find_all_any_replace(self):
+        # 互不重叠的匹配可以直接交给 apply_edits 替换
+        pt = PieceTable('print(int(x)) in y')
+        self.assertEqual(list(pt.find_all_any(['in', 'int'])), [(2, 'in'), (2, 'int'), (6, 'in'), (6, 'int'), (14, 'in')])
+        matches = list(pt.find_all_any(['in', 'int'], overlapping=False))
+        self.assertEqual(matches, [(2, 'int'), (6, 'int'), (14, 'in')])
+        pt.apply_edits([(pos, len(word), 'X') for pos, word in matches])
+        self.assertEqual(pt.get_sequence(), 'prX(X(x)) X y')
+
+    def test_journal_replay(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            for seed in range(20):
+                journal = Journal(os.path.join(dirname, '%d.acj' % seed))
+                journal.start()
+                edits = RandomEdits(seed, 'journal\n')
+                edits.pt.journal = journal
+                for _ in range(40):
+                    edits.step()
+                journal.close()
+                restored = Journal(journal.path).restore('journal\n')
+                restored.journal.close()
+                self.check(restored, edits.model)
+                self.assertEqual(restored.snaps, edits.pt.snaps)
+                while restored.snaps:
+                    restored.undo()
+                    self.check(restored, edits.states[restored.snaps])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import random
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SearchPattern import SearchPattern
+
+ALPHABET = 'abc d\n_中'
+ATOMS = ['a', 'b', 'c', 'ab', 'abc', ' ', '\\w', '\\d', '.', '[ab]', '(?:a|bc)', '(ab)', '\\b', '^', '$']
+QUANTIFIERS = ['', '', '', '*', '+', '?', '{2}', '{1,3}', '*?', '+?']
+
+
+def plain_find_all(pattern, text, begin=0, regex=False, ignore_case=False, whole_word=False):
+    # 不做任何预过滤，逐个 search 得到的互不重叠的匹配，作为对照
+    source = pattern if regex else re.escape(pattern)
+    if whole_word:
+        prefix = re.match(r'(\(\?[aiLmsux]+\))*', source).group()
+        source = prefix + r'(?<!\w)(?:' + source[len(prefix):] + r')(?!\w)'
+    compiled = re.compile(source, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    result = []
+    pos = max(0, begin)
+    while pos <= len(text):
+        match = compiled.search(text, pos)
+        if match is None:
+            break
+        result.append((match.start(), match.end() - match.start()))
+        pos = match.end() if match.end() > match.start() else match.end() + 1
+    return result
+
+
+def random_pattern(rng):
+    parts = []
+    for _ in range(rng.randint(1, 4)):
+        parts.append(rng.choice(ATOMS) + rng.choice(QUANTIFIERS))
+    pattern = ''.join(parts)
+    if rng.random() < 0.2:
+        pattern = '(?:' + pattern + ')' + rng.choice(['+', '{2}', '*'])
+    if rng.random() < 0.2:
+        pattern = rng.choice(['(?<=a)', '(?<!b)', '(?=c)', '(?!a)']) + pattern
+    if rng.random() < 0.2:
+        pattern += rng.choice(['(?=c)', '(?!a)', '(?<=b)'])
+    return pattern
+
+
+class SearchPatternTest(unittest.TestCase):
+
+    def check(self, pattern, text, regex=True, ignore_case=False, whole_word=False):
+        search_pattern = SearchPattern(pattern, regex, ignore_case, whole_word)
+        for begin in (0, 1, len(text) // 2, len(text)):
+            self.assertEqual(list(search_pattern.find_all(text, begin)),
+                             plain_find_all(pattern, text, begin, regex, ignore_case, whole_word),
+                             (pattern, text, begin, regex, ignore_case, whole_word))
+
+    def test_fixed_offset(self):
+        text = 'foo12bar foobar foo3bar abcef abdef abef xfoo99barx'
+        for pattern in [r'foo\d+bar', r'ab(c|d)ef', r'\d{2}bar', r'f.o\d', r'x?foo']:
+            self.assertTrue(SearchPattern(pattern, regex=True).literal, pattern)
+            self.check(pattern, text)
+
+    def test_variable_width(self):
+        text = 'going sing ring ing a end aend a\nend xxxy xy xxxxxxxy'
+        for pattern in [r'\w+ing', r'a.*?end', r'a.*end', r'x{2,5}y', r'\s*end', r'[^ ]*y']:
+            self.check(pattern, text)
+
+    def test_repeated_group(self):
+        text = 'ababc abc c bananana nana aabbc abababab'
+        for pattern in [r'(ab)+c', r'(?:ba)*nana', r'(a|b){2,}c', r'(?:ab){2}', r'(?:na)+?']:
+            self.check(pattern, text)
+
+    def test_lookaround(self):
+        text = 'abc abd xabc xabd bcd abcd'
+        for pattern in [r'(?<=a)bc', r'bc(?=d)', r'(?<!x)ab(?!c)', r'(?<=\s)x?ab', r'ab(?=c|d)c?']:
+            self.check(pattern, text)
+
+    def test_whole_word(self):
+        text = 'ab abc cab ab_ab a b a  b ab\nab 中ab ab中 AB'
+        for pattern in ['ab', 'a b', 'b', 'AB']:
+            for ignore_case in (False, True):
+                self.check(pattern, text, False, ignore_case, True)
+        for pattern in [r'\w+b', r'(?i)ab', r'a\s*b']:
+            self.check(pattern, text, True, False, True)
+
+    def test_empty_matches(self):
+        text = 'aa\n\nb a\n'
+        for pattern in [r'x*', r'^', r'$', r'a*', r'(?=a)', r'\b']:
+            self.check(pattern, text)
+
+    def test_plain_string(self):
+        text = 'aaaa abab 中文中文 aba'
+        for pattern in ['aa', 'ab', 'aba', '中文', 'zz']:
+            self.check(pattern, text, regex=False)
+            self.check(pattern, text, regex=False, ignore_case=True)
+
+    def test_random_against_finditer(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            pattern = random_pattern(rng)
+            text = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 60)))
+            try:
+                re.compile(pattern)
+            except re.error:
+                continue
+            self.check(pattern, text, True, rng.random() < 0.2, rng.random() < 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()